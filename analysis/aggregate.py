@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+
+# Integer codes and the matching values for a column, with -1 for missing.
+# Categoricals reuse their codes; other columns are factorised in sorted
+# order so output rows come out in the same order as a sorted groupby.
+def column_codes(series):
+    if series.dtype.name == 'category':
+        return series.cat.codes.to_numpy(dtype=np.int64), np.asarray(series.cat.categories, dtype=object)
+    codes, values = pd.factorize(series, sort=True)
+    return codes.astype(np.int64), np.asarray(values)
+
+
+# Columns a grouping set is keyed on: the `by` columns plus the grouping,
+# which is None, a column name or a tuple of column names
+def grouping_columns(by, group):
+    by = [by] if isinstance(by, str) else list(by)
+    if group is None:
+        return by
+    return by + ([group] if isinstance(group, str) else list(group))
+
+
+# Sum columns over `by` plus each grouping in groupings, GROUPING SETS
+# style. Every column is coded once and each grouping set is a bincount
+# over the combined codes, rather than a separate groupby. sums maps output
+# column -> cohort column, or None to count rows. Rows with a missing key
+# are left out, and only observed groups are returned, as with groupby.
+def grouping_sets(df, by, groupings, sums):
+    coded = {}
+    weights = {name: None if col is None else np.nan_to_num(df[col].to_numpy(dtype=np.float64))
+               for name, col in sums.items()}
+
+    results = {}
+    for group in groupings:
+        cols = grouping_columns(by, group)
+        key = np.zeros(len(df), dtype=np.int64)
+        valid = np.ones(len(df), dtype=bool)
+        for col in cols:
+            if col not in coded:
+                coded[col] = column_codes(df[col])
+            codes, values = coded[col]
+            key = key * len(values) + codes
+            valid &= codes >= 0
+        key = key[valid]
+        sizes = [len(coded[col][1]) for col in cols]
+        size = int(np.prod(sizes))
+
+        rows = np.bincount(key, minlength=size)
+        observed = np.flatnonzero(rows)
+        positions = np.unravel_index(observed, sizes) if size else [observed] * len(cols)
+        df_out = pd.DataFrame({col: coded[col][1][pos] for col, pos in zip(cols, positions)})
+        for name, w in weights.items():
+            total = rows if w is None else np.bincount(key, weights=w[valid], minlength=size)
+            df_out[name] = total[observed].round().astype(np.int64)
+        results[group] = df_out
+    return results
+
+
+# Combine grouping_sets results computed over separate parts of a cohort
+# (e.g. one month at a time) into the results for the whole cohort. With no
+# parts (e.g. an empty dataset), each of groupings is an empty frame of its
+# grouping columns and the given count columns.
+def merge_grouping_sets(partials, by, groupings=(), columns=()):
+    if not partials:
+        return {group: pd.DataFrame(columns=grouping_columns(by, group) + list(columns)) for group in groupings}
+    merged = {}
+    for group in partials[0]:
+        keys = grouping_columns(by, group)
+        df = pd.concat([partial[group] for partial in partials], ignore_index=True)
+        merged[group] = df.groupby(keys, sort=True).sum().reset_index()
+    return merged
+
+
+# Each patient's latest row over frames given in date order (e.g. one per
+# month), keyed by patient_key (0..n_patients-1) in key order. Values are
+# kept in arrays indexed by key, overwritten in place by each later frame,
+# so only one month and one row per patient are held at a time.
+# Categorical columns are stored as codes into the union of the categories
+# seen. Patients in no frame are left out unless observed_only is False.
+# If changed is given, changed[col] is set for each column in which any
+# patient's value differs between frames.
+def latest_per_patient(frames, n_patients, changed=None, observed_only=True):
+    seen = np.zeros(n_patients, dtype=bool)
+    values, categories = {}, {}
+
+    for df in frames:
+        keys = df['patient_key'].to_numpy(dtype=np.int64)
+        found = seen[keys]
+        for col in df.columns:
+            if col == 'patient_key':
+                continue
+            series = df[col]
+            if series.dtype.name == 'category':
+                known = categories.setdefault(col, [])
+                known.extend([c for c in series.cat.categories if c not in known])
+                new_values = series.cat.set_categories(known).cat.codes.to_numpy(dtype=np.int32)
+            else:
+                new_values = series.to_numpy()
+            if col not in values:
+                dtype = np.int32 if col in categories else new_values.dtype
+                values[col] = np.full(n_patients, -1 if col in categories else missing_value(dtype), dtype=dtype)
+            elif changed is not None and not changed.get(col):
+                changed[col] = differs(values[col][keys[found]], new_values[found])
+            values[col][keys] = new_values
+        seen[keys] = True
+
+    keys = np.flatnonzero(seen) if observed_only else np.arange(n_patients)
+    df_out = pd.DataFrame({'patient_key': keys})
+    for col, arr in values.items():
+        df_out[col] = pd.Categorical.from_codes(arr[keys], categories[col]) if col in categories else arr[keys]
+    return df_out
+
+
+def missing_value(dtype):
+    if dtype.kind == 'f':
+        return np.nan
+    if dtype.kind in 'iub':
+        return 0
+    return None
+
+
+# Whether any pair of values differs, counting two missing values as equal
+def differs(old, new):
+    diff = old != new
+    if old.dtype.kind == 'f' and new.dtype.kind == 'f':
+        diff &= ~(np.isnan(old) & np.isnan(new))
+    return bool(diff.any())
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from instrumentation import peak_rss_mb
+from synthetic_data import write_synthetic_extracts
+
+# Times the post-extraction actions against synthetic extracts of a given
+# size, recording wall time and peak RSS of each action. Run from the
+# repository root, e.g.
+#
+#   python analysis/benchmark.py --rows 10000 1000000 --months 30
+#
+# Each size runs in a scratch workspace, so output/ is left untouched.
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Actions in pipeline order, as run in project.yaml
+stages = [
+    ('join_ethnicity_all_patients', ['python', 'analysis/join_ethnicity.py', 'input_all_patients']),
+    ('consolidate_all_patients', ['python', 'analysis/consolidate_cohorts.py', 'all_patients']),
+    ('derive_elev_predm', ['python', 'analysis/derive_elev_predm.py']),
+    ('calculate_measures', ['python', 'analysis/calculate_measures.py']),
+    ('redact_measures', ['python', 'analysis/redact_measures.py']),
+    ('generate_elev_predm_inputs', ['python', 'analysis/elev_predm_input.py']),
+    ('generate_summaries', ['python', 'analysis/summaries.py']),
+    ('generate_data_description', ['jupyter', 'nbconvert', 'notebooks/data_description.ipynb',
+                                   '--execute', '--to', 'html', '--output-dir=output']),
+    ('generate_tables', ['jupyter', 'nbconvert', 'notebooks/tables.ipynb',
+                         '--execute', '--to', 'html', '--output-dir=output']),
+]
+
+
+# Scratch workspace with synthetic extracts for every month in output/data
+def make_workspace(workspace, rows, months, fmt, seed):
+    for name in ['analysis', 'codelists']:
+        os.symlink(os.path.join(repo_dir, name), os.path.join(workspace, name))
+    # Copied rather than linked, so the notebooks' ../output resolves to
+    # the workspace
+    shutil.copytree(os.path.join(repo_dir, 'notebooks'), os.path.join(workspace, 'notebooks'))
+    write_synthetic_extracts(os.path.join(workspace, 'output', 'data'), rows, months, fmt, seed)
+
+
+# Run one action, returning its wall time and the peak RSS of the process
+def run_stage(command, workspace):
+    if shutil.which(command[0]) is None:
+        return {'status': f'skipped: {command[0]} not found'}
+    # stderr goes to a file rather than a pipe, which a stage writing more
+    # than the pipe buffer would block on while wait4 waits for it
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command, cwd=workspace, stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        stderr.seek(max(stderr.tell() - 2000, 0))
+        return {
+            'status': 'ok' if os.waitstatus_to_exitcode(status) == 0 else 'failed',
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+            'peak_rss_mb': peak_rss_mb(usage),
+            'stderr': stderr.read().decode(errors='replace'),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help='patients per monthly extract, one benchmark per value')
+    parser.add_argument('--months', type=int, default=30)
+    parser.add_argument('--format', default='feather', choices=['feather', 'parquet', 'csv'])
+    parser.add_argument('--stages', nargs='+',
+                        help='only report these actions; earlier actions they depend on still run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='logs/benchmark_results.json')
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        workspace = tempfile.mkdtemp(prefix=f'hba1c_benchmark_{rows}_')
+        try:
+            start = time.perf_counter()
+            make_workspace(workspace, rows, args.months, args.format, args.seed)
+            print(f'{rows} rows x {args.months} months: generated in {time.perf_counter() - start:.1f}s')
+            last = max(i for i, (name, _) in enumerate(stages) if not args.stages or name in args.stages)
+            for name, command in stages[:last + 1]:
+                result = run_stage([sys.executable if c == 'python' else c for c in command], workspace)
+                if args.stages and name not in args.stages:
+                    continue
+                results.append({'rows': rows, 'months': args.months, 'format': args.format,
+                                'stage': name, **result})
+                print(f"  {name}: {result['status']}"
+                      + (f", {result['wall_seconds']}s, {result['peak_rss_mb']} MB" if 'wall_seconds' in result else ''))
+        finally:
+            shutil.rmtree(workspace)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,196 @@
+import ast
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+from config import cache
+from instrumentation import stage
+from io_utils import atomic_path, file_entry, file_hash, matches_entry, read_json, umask_mode, write_json
+
+# Content-addressed cache of derived results on local disk. An entry is
+# keyed on the SHA-256 of every input file, the source of the module that
+# defines the producing function and of every analysis module it imports,
+# directly or not, and its arguments, so rerunning a stage whose inputs and
+# code are unchanged is a lookup. Entries are evicted least recently used
+# first once the cache grows past cache['max_mb']. With cache['enabled']
+# off (--no-cache, as on the OpenSAFELY backend, where output/cache does
+# not persist between actions) every call runs.
+
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+
+# --no-cache option for the scripts that use the cache, applied with
+# set_enabled(args.cache)
+def add_cache_argument(parser):
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='recompute everything without reading or writing the cache')
+
+
+def set_enabled(enabled):
+    cache['enabled'] = enabled
+
+
+# Input hashes already computed, by path, with the size and mtime they were
+# computed for, so unchanged inputs are not re-read on every lookup
+def hash_index_path():
+    return os.path.join(cache['dir'], 'input_hashes.json')
+
+
+# Files under each input path (a file or a directory such as a dataset),
+# with their content hashes
+def input_hashes(paths):
+    index = read_json(hash_index_path(), {})
+    hashes, changed = [], False
+    for path in paths:
+        # A missing input (e.g. a dataset not yet consolidated) has no hash
+        if not os.path.exists(path):
+            hashes.append((path, None))
+            continue
+        files = sorted(os.path.join(root, file) for root, _, files in os.walk(path) for file in files) \
+            if os.path.isdir(path) else [path]
+        for file_path in files:
+            entry = index.get(file_path)
+            if not matches_entry(file_path, entry):
+                entry = index[file_path] = file_entry(file_path)
+                changed = True
+            hashes.append((file_path, entry['sha256']))
+    if changed:
+        os.makedirs(cache['dir'], exist_ok=True)
+        write_json(hash_index_path(), index)
+    return hashes
+
+
+# Analysis modules imported by the module at path
+def imported_modules(path):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return [os.path.join(analysis_dir, f'{name}.py') for name in sorted(names)
+            if os.path.exists(os.path.join(analysis_dir, f'{name}.py'))]
+
+
+# Source files of the module defining func and of every analysis module it
+# depends on through imports, config included, in path order
+def code_files(func):
+    seen, pending = set(), [os.path.abspath(sys.modules[func.__module__].__file__)]
+    while pending:
+        path = pending.pop()
+        if path not in seen:
+            seen.add(path)
+            pending.extend(imported_modules(path))
+    return sorted(seen)
+
+
+def cache_key(func, inputs, args=()):
+    key = {
+        'function': func.__qualname__,
+        'code': [(os.path.basename(path), file_hash(path)) for path in code_files(func)],
+        'inputs': input_hashes(inputs),
+        'args': repr(args),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def entry_dir(key):
+    return os.path.join(cache['dir'], key[:2], key)
+
+
+# Build an entry in a temporary directory and rename it into place, so a
+# concurrent or failed run never sees a partial entry
+def store_entry(key, write):
+    final_dir = entry_dir(key)
+    os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(final_dir), prefix=f'.{key}.')
+    try:
+        write(tmp_dir)
+        if os.path.exists(final_dir):
+            return
+        os.chmod(tmp_dir, umask_mode(0o777))
+        os.replace(tmp_dir, final_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict()
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+# Drop the least recently used entries until the cache fits in max_mb.
+# An entry's mtime is refreshed on every hit.
+def evict(max_mb=None):
+    max_bytes = (cache['max_mb'] if max_mb is None else max_mb) * (1 << 20)
+    entries = [os.path.join(cache['dir'], prefix, key)
+               for prefix in os.listdir(cache['dir']) if os.path.isdir(os.path.join(cache['dir'], prefix))
+               for key in os.listdir(os.path.join(cache['dir'], prefix)) if not key.startswith('.')]
+    entries = sorted(((os.path.getmtime(path), dir_size(path), path) for path in entries), reverse=True)
+    total = 0
+    for _, size, path in entries:
+        total += size
+        if total > max_bytes:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def lookup(key):
+    path = entry_dir(key)
+    if not os.path.isdir(path):
+        return None
+    os.utime(path)
+    return path
+
+
+# Result of func(*args), from the cache when its inputs, code and
+# arguments are unchanged. The result is stored pickled.
+def cached_call(func, inputs, *args):
+    if not cache['enabled']:
+        return func(*args)
+    key = cache_key(func, inputs, args)
+    with stage('cached_call', function=func.__qualname__) as metrics:
+        path = lookup(key)
+        metrics['cache_hit'] = path is not None
+        if path is not None:
+            with open(os.path.join(path, 'result.pickle'), 'rb') as f:
+                return pickle.load(f)
+
+        result = func(*args)
+
+        def write(tmp_dir):
+            with open(os.path.join(tmp_dir, 'result.pickle'), 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        store_entry(key, write)
+        return result
+
+
+# Run func(*args) to write the files in outputs, unless an entry for the
+# same inputs, code and arguments exists, in which case its copies of the
+# outputs are restored instead. Inputs are hashed before func runs, so a
+# file rewritten in place (e.g. by redact_measures) is keyed on its
+# original contents.
+def cached_outputs(func, inputs, outputs, *args):
+    if not cache['enabled']:
+        func(*args)
+        return
+    key = cache_key(func, inputs, args)
+    with stage('cached_outputs', function=func.__qualname__) as metrics:
+        path = lookup(key)
+        metrics['cache_hit'] = path is not None
+        if path is not None:
+            for i, out_path in enumerate(outputs):
+                with atomic_path(out_path) as tmp_path:
+                    shutil.copyfile(os.path.join(path, str(i)), tmp_path)
+            return
+
+        func(*args)
+
+        def write(tmp_dir):
+            for i, out_path in enumerate(outputs):
+                shutil.copyfile(out_path, os.path.join(tmp_dir, str(i)))
+        store_entry(key, write)
@@ -0,0 +1,54 @@
+import os
+import pandas as pd
+
+from aggregate import grouping_columns, grouping_sets
+from config import hba1c_thresholds
+from instrumentation import stage, write_report
+from io_utils import dataset_dates, partition_path, read_dataset
+from measures import measure_matrix
+from thresholds import band_col, band_sums, threshold_column
+
+# Computes every measure in measure_matrix from the consolidated cohort in
+# one scan per month, in place of cohortextractor generate_measures, which
+# runs a separate groupby over every monthly file for each measure. Output
+# files match its measure_<id>.csv layout.
+
+measures = measure_matrix()
+
+# Each distinct group_by is one grouping set; all numerators are summed for
+# every set in the same pass. Counts above each HbA1c threshold come from
+# counting by threshold band as well, so they add no columns to read or sum.
+groupings = list(dict.fromkeys(tuple(m['group_by']) for m in measures))
+numerators = list(dict.fromkeys(m['numerator'] for m in measures))
+threshold_numerators = [threshold_column(limit) for limit in hba1c_thresholds]
+sums = {'population': None, **{numerator: numerator for numerator in numerators
+                               if numerator not in threshold_numerators}}
+
+import_vars = list(dict.fromkeys(col for group in groupings for col in group)) + list(sums)[1:] + [band_col]
+
+monthly = {group: [] for group in groupings}
+for date in dataset_dates('all_patients'):
+    label = f'{date:%Y-%m-%d}'
+    with stage('read_month', [os.path.dirname(partition_path('all_patients', date))], date=label) as metrics:
+        df_month = read_dataset('all_patients', import_vars, date, date)
+        metrics['rows_out'] = len(df_month)
+    with stage('grouping_sets', date=label) as metrics:
+        metrics['rows_in'] = len(df_month)
+        results = grouping_sets(df_month, ['date', band_col], groupings, sums)
+        results = {group: band_sums(df_out, grouping_columns('date', group), 'population')
+                   for group, df_out in results.items()}
+        metrics['rows_out'] = sum(len(df_out) for df_out in results.values())
+    for group, df_out in results.items():
+        monthly[group].append(df_out)
+
+for measure in measures:
+    group, numerator = tuple(measure['group_by']), measure['numerator']
+    file_path = os.path.join('output/data', f"measure_{measure['id']}.csv")
+    with stage('write_measure', outputs=[file_path], measure=measure['id']) as metrics:
+        df = pd.concat(monthly[group], ignore_index=True)
+        df = df[list(group) + [numerator, 'population', 'date']]
+        df.insert(len(group) + 2, 'value', df[numerator] / df['population'])
+        df.to_csv(file_path, index=False)
+        metrics['rows_out'] = len(df)
+
+write_report('calculate_measures')
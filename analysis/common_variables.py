@@ -101,6 +101,7 @@ common_variables = dict(
         on_or_before="index_date",
         return_last_date_in_period=True,
         include_month=True,
+        return_expectations={"incidence": 0.03},
     ),
 
     type2_diabetes=patients.with_these_clinical_events(
@@ -108,6 +109,7 @@ common_variables = dict(
         on_or_before="index_date",
         return_last_date_in_period=True,
         include_month=True,
+        return_expectations={"incidence": 0.2},
     ),
 
     unknown_diabetes=patients.with_these_clinical_events(
@@ -115,6 +117,7 @@ common_variables = dict(
         on_or_before="index_date",
         return_last_date_in_period=True,
         include_month=True,
+        return_expectations={"incidence": 0.02},
     ),
     
     diabetes_type=patients.categorised_as(
@@ -246,52 +249,6 @@ common_variables = dict(
                               },
     ),
     
-    # Flag elevated levels        
-    hba1c_gt_48=patients.categorised_as(
-        {"0": "DEFAULT", "1": """hba1c_mmol_per_mol > 48"""},
-        return_expectations = {"rate": "universal",
-                              "category": {
-                                  "ratios": {
-                                      "0": 0.70,
-                                      "1": 0.30,
-                                      }
-                                  },
-                              },
-    ),
-    hba1c_gt_58=patients.categorised_as(
-        {"0": "DEFAULT", "1": """hba1c_mmol_per_mol > 58"""},
-        return_expectations = {"rate": "universal",
-                              "category": {
-                                  "ratios": {
-                                      "0": 0.80,
-                                      "1": 0.20,
-                                      }
-                                  },
-                              },
-    ),
-    hba1c_gt_64=patients.categorised_as(
-        {"0": "DEFAULT", "1": """hba1c_mmol_per_mol > 64"""},
-        return_expectations = {"rate": "universal",
-                              "category": {
-                                  "ratios": {
-                                      "0": 0.90,
-                                      "1": 0.10,
-                                      }
-                                  },
-                              },
-    ),
-    hba1c_gt_75=patients.categorised_as(
-        {"0": "DEFAULT", "1": """hba1c_mmol_per_mol > 75"""},
-        return_expectations = {"rate": "universal",
-                              "category": {
-                                  "ratios": {
-                                      "0": 0.95,
-                                      "1": 0.05,
-                                      }
-                                  },
-                              },
-    ),
-    
     # Learning disabilities
     learning_disability=patients.with_these_clinical_events(
         learning_disability_codes,
@@ -5,10 +5,40 @@ start_date = "2019-01-01"
 end_date = "2021-06-01"
 
 #demographic variables by which code use is broken down
-demographics = ["sex", "age_band", "region", "imd", "ethnicity", "learning_disability"]
+demographics = ["age_group", "sex", "ethnicity", "region", "imd", "learning_disability", "mental_illness"]
+
+#short names of demographics in measure ids, where different from the variable
+measure_demographic_ids = {"age_group": "age", "learning_disability": "ld", "mental_illness": "mi"}
 
 # #name of measure
 # marker="Systolic blood pressure"
 
 # #codelist path
-# codelist_path = "codelists/opensafely-systolic-blood-pressure-qof.csv"
\ No newline at end of file
+# codelist_path = "codelists/opensafely-systolic-blood-pressure-qof.csv"
+
+#patient attributes stored once per patient rather than in every monthly partition,
+#where no patient's value changes between months
+static_attributes = ["sex", "ethnicity", "learning_disability", "region", "imd"]
+
+#number of worker processes used for per-month processing
+workers = 1
+
+#small number suppression: counts at or below the threshold are redacted,
+#optionally with secondary suppression and rounding of the remaining counts
+suppression = {"threshold": 5, "secondary": False, "rounding": None}
+
+#NICE HbA1c thresholds (mmol/mol); counts above each are derived from one band column
+hba1c_thresholds = [48, 58, 64, 75]
+
+#numerator of each measure, keyed by measure id prefix
+measure_numerators = {
+    "total_tests": "took_hba1c",
+    **{f"tests_gt{limit}": f"hba1c_gt_{limit}" for limit in hba1c_thresholds},
+}
+
+#local cache of derived results, evicted least recently used first beyond max_mb;
+#the actions in project.yaml turn it off with --no-cache
+cache = {"dir": "output/cache", "max_mb": 1024, "enabled": True}
+
+#event-level tables read by local_extract.py, as parquet files or events.sqlite
+events_dir = "output/events"
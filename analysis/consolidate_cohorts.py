@@ -0,0 +1,82 @@
+import argparse
+import numpy as np
+import os
+
+from aggregate import latest_per_patient
+from config import static_attributes, workers
+from functools import partial
+from instrumentation import counted, stage, write_report
+from io_utils import (cohort_columns, cohort_files, file_date, fixed_file, iter_cohort_chunks, partition_path,
+                      read_cohort, remove_stale_partitions, write_cohort_chunks, write_dimension)
+from parallel import map_files
+from patient_keys import key_frame, read_keys
+from schema import apply_schema
+from thresholds import add_band
+
+# Rows read from each monthly extract at a time
+chunk_size = 500000
+
+
+# Variables of the study's fixed extract (see io_utils.fixed_file) not in
+# its monthly extracts, as one row per patient_key; patients without a row
+# get 0 or ''
+def fixed_columns(file_path, study, exclude):
+    df_fixed = read_cohort(file_path, typed=False)
+    return key_frame(df_fixed, read_keys(study),
+                     df_fixed.columns.drop(['patient_id', 'patient_key'] + list(exclude), errors='ignore'))
+
+
+# Store the static attributes that are the same for each patient in every
+# extract once per patient, in the study's patient dimension, reading only
+# patient_key and those columns, along with the variables of any fixed
+# extract and the key map (patient_id). Returns the columns moved out of the monthly partitions;
+# attributes that change for any patient stay in them.
+def build_dimension(file_paths, study):
+    monthly_columns = cohort_columns(file_paths[0])
+    candidates = [col for col in static_attributes if col in monthly_columns]
+    fixed_path = fixed_file(study)
+    inputs = file_paths + ([fixed_path] if fixed_path else [])
+    with stage('patient_dimension', inputs, candidates=candidates) as metrics:
+        frames = counted((read_cohort(file_path, ['patient_key'] + candidates) for file_path in file_paths),
+                         metrics, 'rows_in')
+        changed = {}
+        keys = read_keys(study)
+        df_patients = latest_per_patient(frames, len(keys), changed, observed_only=False)
+        static = [col for col in candidates if not changed.get(col)]
+        df_patients = df_patients[['patient_key'] + static].assign(patient_id=np.asarray(keys))
+        if fixed_path:
+            df_fixed = fixed_columns(fixed_path, study, monthly_columns)
+            df_patients = df_patients.merge(df_fixed, on='patient_key', how='left', sort=False)
+            metrics['fixed'] = list(df_fixed.columns.drop('patient_key'))
+        write_dimension(df_patients, study)
+        metrics['rows_out'] = len(df_patients)
+        metrics['static'] = static
+    return static
+
+
+# Copy one monthly extract into its date partition of the study dataset,
+# stored with the schema's compact dtypes and the HbA1c threshold band,
+# leaving out the columns held in the patient dimension
+def consolidate_file(file_path, study, static=()):
+    out_path = partition_path(study, file_date(file_path))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with stage('consolidate_file', [file_path], [out_path], file=os.path.basename(file_path)) as metrics:
+        chunks = counted(iter_cohort_chunks(file_path, chunk_size), metrics, 'rows_in')
+        chunks = counted((apply_schema(add_band(df.drop(columns=list(static)))) for df in chunks),
+                         metrics, 'rows_out')
+        write_cohort_chunks(chunks, out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('study', help='e.g. all_patients for input_all_patients_*')
+    parser.add_argument('--workers', type=int, default=workers)
+    args = parser.parse_args()
+
+    file_paths = cohort_files(args.study)
+    static = build_dimension(file_paths, args.study)
+    map_files(partial(consolidate_file, study=args.study, static=static), file_paths, args.workers)
+    with stage('remove_stale_partitions') as metrics:
+        stale = remove_stale_partitions(args.study, [file_date(file_path) for file_path in file_paths])
+        metrics['removed'] = [f'{date:%Y-%m-%d}' for date in stale]
+    write_report(f'consolidate_{args.study}')
@@ -0,0 +1,78 @@
+import argparse
+import os
+import pyarrow.parquet as pq
+
+from config import workers
+from expressions import evaluate, truthy
+from functools import partial
+from instrumentation import stage, write_report
+from io_utils import (atomic_path, attach_dimension, dataset_dates, dimension_columns, dimension_dir,
+                      dimension_patient_ids, find_cohort_file, partition_path, read_cohort, remove_stale_partitions,
+                      write_dimension)
+from parallel import map_files
+from patient_keys import key_frame
+from study_variables import study_variables
+
+# The elev_predm cohort derived from the consolidated all_patients dataset
+# rather than extracted a second time. Its population was the all_patients
+# population restricted to patients with prev_elevated_48 OR
+# prepandemic_prediabetes, and its other variables common_variables plus
+# prepandemic variables fixed at 2020-03-01. study_definition_prepandemic
+# extracts those once per patient (input_prepandemic); each all_patients
+# partition is filtered to the patients meeting its population condition
+# and written as the elev_predm partition, and the prepandemic variables
+# are added to the all_patients patient dimension as elev_predm's, from
+# which read_dataset attaches them to each month. elev_predm shares the
+# all_patients patient keys, read from that dimension.
+
+source_study = 'all_patients'
+study = 'elev_predm'
+
+
+# Patients of the cohort, by key, and the prepandemic variables as one row
+# per key. The population condition is evaluated here, as dummy data does
+# not apply it.
+def prepandemic_patients(file_path, keys):
+    variables = study_variables('prepandemic')
+    df = read_cohort(file_path, typed=False)
+    columns = [name for name in variables if name != 'population']
+    df_keys = key_frame(df, keys, columns)
+    in_cohort = truthy(evaluate(variables['population']['args'][0], {col: df_keys[col].to_numpy() for col in columns}))
+    return in_cohort, df_keys
+
+
+# The all_patients dimension with the prepandemic variables added
+def build_dimension(df_prepandemic):
+    df = attach_dimension(df_prepandemic[['patient_key']].copy(), source_study, list(dimension_columns(source_study)))
+    write_dimension(df.join(df_prepandemic.drop(columns=['patient_key'])), study)
+
+
+# Copy the cohort's rows of one all_patients partition to elev_predm
+def derive_partition(date, in_cohort):
+    in_path, out_path = partition_path(source_study, date), partition_path(study, date)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with stage('derive_partition', [in_path], [out_path], date=f'{date:%Y-%m-%d}') as metrics:
+        table = pq.read_table(in_path)
+        metrics['rows_in'] = table.num_rows
+        keys = table.column('patient_key').to_numpy()
+        table = table.filter(in_cohort[keys])
+        with atomic_path(out_path) as tmp_path:
+            pq.write_table(table, tmp_path)
+        metrics['rows_out'] = table.num_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=workers)
+    args = parser.parse_args()
+
+    file_path = find_cohort_file('output/data/input_prepandemic')
+    with stage('prepandemic', [file_path]) as metrics:
+        in_cohort, df_prepandemic = prepandemic_patients(file_path, dimension_patient_ids(source_study))
+        metrics['rows_out'] = int(in_cohort.sum())
+    with stage('patient_dimension', outputs=[dimension_dir(study)]):
+        build_dimension(df_prepandemic)
+    dates = dataset_dates(source_study)
+    map_files(partial(derive_partition, in_cohort=in_cohort), dates, args.workers)
+    remove_stale_partitions(study, dates)
+    write_report('derive_elev_predm')
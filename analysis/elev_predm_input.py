@@ -1,75 +1,40 @@
+import argparse
 import numpy as np
-import pandas as pd
-import re
+import os
 
-from functools import reduce
-from datetime import datetime
-from glob import glob
+from aggregate import grouping_columns, grouping_sets, merge_grouping_sets
+from cache import add_cache_argument, cached_call, set_enabled
+from config import hba1c_thresholds
+from instrumentation import stage, write_report
+from io_utils import dataset_dates, dataset_dir, dimension_dir, partition_path, read_dataset
+from suppression import suppress
+from thresholds import band_col, band_sums, threshold_column
 
 
 # Demographics
 demo_vars = {'age_group':'age', 'sex':'sex', 'ethnicity':'eth', 'region':'reg',
              'imd':'imd', 'learning_disability':'ld', 'mental_illness':'mi'}
 
-# NICE thresholds
-threshold_vars = ['hba1c_gt_48', 'hba1c_gt_58', 'hba1c_gt_64', 'hba1c_gt_75']
-
 # Import variables
-import_vars = threshold_vars + list(demo_vars.keys()) + ['patient_id', 'diabetes_type', 'took_hba1c', 'prev_elevated_48',
-                                            'prepandemic_hba1c', 'hba1c_mmol_per_mol', 'prepandemic_prediabetes']
-
-# Read in and append input files
-li_elev = []
-li_predm = []
-
-for file in glob('output/data/input_elev*.csv'):
-    df_temp = pd.read_csv(file)[import_vars]
-    # Creates date variable based on file name
-    df_temp['date'] = file[(re.search(r"\d",file).start()):-4]
-    df_temp['date'] = df_temp['date'].apply(lambda x: datetime.strptime(x.strip(), '%Y-%m-%d'))
-    # Filter to T2DM patients with elevated HbA1c pre-pandemic
-    df_temp_elev = df_temp.loc[(df_temp.diabetes_type == 'T2DM') & 
-                               (df_temp.prev_elevated_48 == 1)]
-     # Filter to prediabetic patients pre-pandemic
-    df_temp_predm = df_temp.loc[(df_temp.prepandemic_prediabetes == 1)]
-    # Generates a count column
-    df_temp_elev['population'] = 1
-    df_temp_predm['population'] = 1
-    # Append
-    li_elev.append(df_temp_elev)
-    li_predm.append(df_temp_predm)
-    
-df_t2dm_elev = pd.concat(li_elev, axis=0, ignore_index=False).reset_index(drop=True)
-df_predm = pd.concat(li_predm, axis=0, ignore_index=False).reset_index(drop=True)
-
-# Get counts for each group
-def gen_sum(df_in, group=''):
-    
-    groups = ['date']
-    if group != '': 
-        groups = ['date', group]
-        
-    df_out = df_in.groupby(groups).agg(
-                                       ct_population = ('population', 'sum'),
-                                       ct_took_hba1c  = ('took_hba1c', 'sum'),
-                                       ct_hba1c_gt_48 = ('hba1c_gt_48','sum'),
-                                       ct_hba1c_gt_58 = ('hba1c_gt_58','sum'),
-                                       ct_hba1c_gt_64 = ('hba1c_gt_64','sum'),
-                                       ct_hba1c_gt_75 = ('hba1c_gt_75','sum'),
-                                      ).reset_index()
-    
+import_vars = [band_col] + list(demo_vars.keys()) + ['diabetes_type', 'took_hba1c', 'prev_elevated_48',
+                                            'prepandemic_prediabetes']
+
+# Count columns and the variable each one sums (None counts patients).
+# Counts above each NICE threshold are derived from the HbA1c band.
+ct_vars = {'ct_population': None, 'ct_took_hba1c': 'took_hba1c'}
+ct_cols = list(ct_vars) + [threshold_column(limit, 'ct_') for limit in hba1c_thresholds]
+
+# Groupings: by date only, then by date and each demographic
+groupings = [None] + list(demo_vars)
+
+def add_rates(df_out):
     # Apply redaction to low counts
-    ct_cols = ['ct_population','ct_took_hba1c', 'ct_hba1c_gt_48', 'ct_hba1c_gt_58',
-               'ct_hba1c_gt_64', 'ct_hba1c_gt_75']
-    for col in ct_cols:
-        df_out[col] = df_out[col].where(df_out[col] >= 6, np.nan)
+    df_out = suppress(df_out, ct_cols, by='date', action='mask')
 
     # Create per 1,000 columns
     df_out['tests_per_1000'] = (df_out['ct_took_hba1c']/df_out['ct_population'])*1000
-    df_out['gt48_per_1000'] = (df_out['ct_hba1c_gt_48']/df_out['ct_population'])*1000
-    df_out['gt58_per_1000'] = (df_out['ct_hba1c_gt_58']/df_out['ct_population'])*1000
-    df_out['gt64_per_1000'] = (df_out['ct_hba1c_gt_64']/df_out['ct_population'])*1000
-    df_out['gt75_per_1000'] = (df_out['ct_hba1c_gt_75']/df_out['ct_population'])*1000
+    for limit in hba1c_thresholds:
+        df_out[f'gt{limit}_per_1000'] = (df_out[threshold_column(limit, 'ct_')]/df_out['ct_population'])*1000
 
     return df_out
 
@@ -84,24 +49,70 @@ lookup_dict = {
         "learning_disability":   {1:'Yes', 0:'No'}
 }
 
-df_t2dm_elev_sum = gen_sum(df_t2dm_elev)
-df_t2dm_elev_sum.to_csv('output/data/calc_t2dm_elev.csv')
-
-df_predm_sum = gen_sum(df_predm)
-df_predm_sum.to_csv('output/data/calc_predm.csv')
+# Read in the consolidated extracts one month at a time, keeping only the
+# counts for each grouping, so the whole study period is never in memory
+def cohort_sums():
+    elev_parts = []
+    predm_parts = []
+
+    for date in dataset_dates('elev_predm'):
+        label = f'{date:%Y-%m-%d}'
+        with stage('read_month', [os.path.dirname(partition_path('elev_predm', date))], date=label) as metrics:
+            df_month = read_dataset('elev_predm', import_vars, date, date)
+            metrics['rows_out'] = len(df_month)
+
+        with stage('filter', date=label) as metrics:
+            metrics['rows_in'] = len(df_month)
+            # Filter to T2DM patients with elevated HbA1c pre-pandemic
+            df_t2dm_elev = df_month.loc[(df_month.diabetes_type == 'T2DM') &
+                                        (df_month.prev_elevated_48 == 1)]
+            # Filter to prediabetic patients pre-pandemic
+            df_predm = df_month.loc[(df_month.prepandemic_prediabetes == 1)]
+            metrics['rows_out'] = len(df_t2dm_elev) + len(df_predm)
+
+        for cohort, df_cohort, parts in [('t2dm_elev', df_t2dm_elev, elev_parts), ('predm', df_predm, predm_parts)]:
+            with stage('grouping_sets', date=label, cohort=cohort) as metrics:
+                metrics['rows_in'] = len(df_cohort)
+                sums = grouping_sets(df_cohort, ['date', band_col], groupings, ct_vars)
+                parts.append({g: band_sums(df_out, grouping_columns('date', g), 'ct_population', 'ct_')
+                              for g, df_out in sums.items()})
+                metrics['rows_out'] = sum(len(df_out) for df_out in parts[-1].values())
+
+    # Combine the monthly counts
+    with stage('merge'):
+        elev_sums = {g: add_rates(df) for g, df in merge_grouping_sets(elev_parts, 'date', groupings, ct_cols).items()}
+        predm_sums = {g: add_rates(df)
+                      for g, df in merge_grouping_sets(predm_parts, 'date', groupings, ct_cols).items()}
+    return elev_sums, predm_sums
+
+
+parser = argparse.ArgumentParser()
+add_cache_argument(parser)
+set_enabled(parser.parse_args().cache)
+
+# Reruns against unchanged partitions are served from the cache
+elev_sums, predm_sums = cached_call(cohort_sums, [dataset_dir('elev_predm'), dimension_dir('elev_predm')])
+
+with stage('write', outputs=['output/data/calc_t2dm_elev.csv', 'output/data/calc_predm.csv']):
+    elev_sums[None].to_csv('output/data/calc_t2dm_elev.csv')
+    predm_sums[None].to_csv('output/data/calc_predm.csv')
 
 for g in demo_vars:
-    df_elev_tmp = gen_sum(df_t2dm_elev, g)
-    df_predm_tmp = gen_sum(df_predm, g)
+    out_paths = [f'output/data/calc_t2dm_elev_{demo_vars[g]}.csv', f'output/data/calc_predm_{demo_vars[g]}.csv']
+    with stage('write', outputs=out_paths, grouping=g):
+        df_elev_tmp = elev_sums[g]
+        df_predm_tmp = predm_sums[g]
+
+        if g in ['ethnicity', 'imd', 'learning_disability']:
+            df_elev_tmp = df_elev_tmp.replace({g: lookup_dict[g]})
+            df_predm_tmp = df_predm_tmp.replace({g: lookup_dict[g]})
 
-    if g in ['ethnicity', 'imd', 'learning_disability']:
-        df_elev_tmp = df_elev_tmp.replace({g: lookup_dict[g]})
-        df_predm_tmp = df_predm_tmp.replace({g: lookup_dict[g]})
+        elif g == "age_group":
+            df_elev_tmp = df_elev_tmp.loc[df_elev_tmp.age_group != '0-15']
+            df_predm_tmp = df_predm_tmp.loc[df_predm_tmp.age_group != '0-15']
 
-    elif g == "age_group":
-        df_elev_tmp = df_elev_tmp.loc[df_elev_tmp.age_group != '0-15']
-        df_predm_tmp = df_predm_tmp.loc[df_predm_tmp.age_group != '0-15']
+        # Export data
+        df_elev_tmp.to_csv(out_paths[0])
+        df_predm_tmp.to_csv(out_paths[1])
 
-    # Export data
-    df_elev_tmp.to_csv(f'output/data/calc_t2dm_elev_{demo_vars[g]}.csv')
-    df_predm_tmp.to_csv(f'output/data/calc_predm_{demo_vars[g]}.csv')
\ No newline at end of file
+write_report('generate_elev_predm_inputs')
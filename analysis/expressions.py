@@ -0,0 +1,245 @@
+import abc
+import numpy as np
+import pandas as pd
+import re
+
+# Evaluates the expression language used by patients.categorised_as and
+# patients.satisfying (AND/OR/NOT, comparisons, arithmetic, bare variables
+# as truth values) over columns of NumPy arrays or categoricals, and
+# resolves the date expressions used for windows ("index_date - 12 months",
+# "last_day_of_month(index_date)", ...).
+
+token_pattern = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>'[^']*'|"[^"]*")
+      | (?P<op><=|>=|!=|==|=|<|>|\(|\)|\+|-|\*|/)
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+keywords = {'AND', 'OR', 'NOT'}
+
+
+def tokenize(expression):
+    tokens, pos = [], 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = token_pattern.match(expression, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f'Cannot parse expression at {expression[pos:]!r}')
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'name' and value.upper() in keywords:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+        pos = m.end()
+    return tokens
+
+
+# Variables an expression refers to
+def expression_names(expression):
+    return [value for kind, value in tokenize(expression) if kind == 'name']
+
+
+# Truth value of a column: non-zero numbers, non-empty strings
+def truthy(values):
+    if isinstance(values, pd.Categorical):
+        return truthy(np.asarray(values.categories, dtype=object))[values.codes] & (values.codes >= 0)
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    if values.dtype.kind in 'iuf':
+        return np.nan_to_num(values) != 0
+    if values.dtype.kind == 'U':
+        return values != ''
+    series = pd.Series(values.ravel())
+    return (series.notna() & (series.astype(str) != '')).to_numpy().reshape(values.shape)
+
+
+# Compare category codes written as strings (e.g. eth = '1') with columns
+# holding them as numbers
+def comparable(left, right):
+    if isinstance(right, str) and numeric(left):
+        return left, float(right) if right.lstrip('-').replace('.', '', 1).isdigit() else right
+    if isinstance(left, str) and numeric(right):
+        return comparable(right, left)[::-1]
+    return left, right
+
+
+def numeric(values):
+    return isinstance(values, (int, float, np.ndarray)) and np.asarray(values).dtype.kind in 'iuf'
+
+
+class Parser:
+    def __init__(self, tokens, columns):
+        self.tokens, self.pos, self.columns = tokens, 0, columns
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if value is not None and token[1] != value:
+            raise ValueError(f'Expected {value!r}, got {token[1]!r}')
+        self.pos += 1
+        return token
+
+    def parse(self):
+        result = self.or_expr()
+        if self.pos != len(self.tokens):
+            raise ValueError(f'Unexpected {self.peek()[1]!r}')
+        return result
+
+    def or_expr(self):
+        result = self.and_expr()
+        while self.peek() == ('keyword', 'OR'):
+            self.take()
+            result = truthy(result) | truthy(self.and_expr())
+        return result
+
+    def and_expr(self):
+        result = self.not_expr()
+        while self.peek() == ('keyword', 'AND'):
+            self.take()
+            result = truthy(result) & truthy(self.not_expr())
+        return result
+
+    def not_expr(self):
+        if self.peek() == ('keyword', 'NOT'):
+            self.take()
+            return ~truthy(self.not_expr())
+        return self.comparison()
+
+    def comparison(self):
+        left = self.arith()
+        kind, op = self.peek()
+        if kind == 'op' and op in ('=', '==', '!=', '<', '<=', '>', '>='):
+            self.take()
+            left, right = comparable(left, self.arith())
+            if op in ('=', '=='):
+                return np.asarray(left == right)
+            if op == '!=':
+                return np.asarray(left != right)
+            left, right = np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64)
+            with np.errstate(invalid='ignore'):
+                return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[op]
+        return left
+
+    def arith(self):
+        result = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            right = self.term()
+            result = result + right if op == '+' else result - right
+        return result
+
+    def term(self):
+        result = self.factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            right = self.factor()
+            result = result * right if op == '*' else result / right
+        return result
+
+    def factor(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return float(value) if '.' in value else int(value)
+        if kind == 'string':
+            return value[1:-1]
+        if kind == 'name':
+            return self.columns[value]
+        if (kind, value) == ('op', '('):
+            result = self.or_expr()
+            self.take(')')
+            return result
+        raise ValueError(f'Unexpected {value!r}')
+
+
+# Evaluate an expression against a mapping of variable name -> array
+def evaluate(expression, columns):
+    return Parser(tokenize(expression), columns).parse()
+
+
+# Values of a categorised_as variable: the first category whose expression
+# holds, else the DEFAULT category
+def evaluate_categories(categories, columns, n):
+    keys = [key for key, expression in categories.items() if expression.strip() != 'DEFAULT']
+    default = next((key for key, expression in categories.items() if expression.strip() == 'DEFAULT'), None)
+    conditions = [np.broadcast_to(truthy(evaluate(categories[key], columns)), (n,)) for key in keys]
+    codes = np.select(conditions, np.arange(len(keys)), default=len(keys))
+    labels = keys + [default if default is not None else '']
+    if all(str(key).isdigit() for key in categories):
+        return np.array(labels, dtype=np.int64)[codes]
+    return pd.Categorical.from_codes(codes, labels)
+
+
+# Columns of a cohort, computed on first use so that expressions can refer
+# to variables declared after them. categorised_as and satisfying variables
+# are evaluated from the columns they refer to; subclasses compute the
+# variables that query the record in query(name, spec).
+class StudyColumns(dict, metaclass=abc.ABCMeta):
+    # dict does not refuse to instantiate classes with abstract methods
+    def __new__(cls, *args, **kwargs):
+        if cls.__abstractmethods__:
+            raise TypeError(f"Can't instantiate {cls.__name__} without {', '.join(sorted(cls.__abstractmethods__))}")
+        return super().__new__(cls, *args, **kwargs)
+
+    def __init__(self, specs, n):
+        super().__init__()
+        self.specs, self.n = specs, n
+
+    def __missing__(self, name):
+        spec = self.specs[name]
+        if spec['function'] == 'categorised_as':
+            values = evaluate_categories(spec['args'][0], self, self.n)
+        elif spec['function'] == 'satisfying':
+            values = np.broadcast_to(truthy(evaluate(spec['args'][0], self)), (self.n,)).astype(np.int64)
+        else:
+            values = self.query(name, spec)
+        self[name] = values
+        return values
+
+    # Column of a variable that queries the record
+    @abc.abstractmethod
+    def query(self, name, spec):
+        ...
+
+
+date_pattern = re.compile(r"""^\s*(?:
+    (?P<func>first_day_of_month|last_day_of_month|first_day_of_year|last_day_of_year)\((?P<arg>.*)\)
+  | (?P<base>\d{4}-\d{2}-\d{2}|[^+-]+?)\s*(?:(?P<sign>[+-])\s*(?P<n>\d+)\s*(?P<unit>days?|months?|years?))?
+)\s*$""", re.VERBOSE)
+
+
+# Resolve a date expression as used in between/on_or_before arguments
+def resolve_date(expression, index_date):
+    if expression is None:
+        return None
+    m = date_pattern.match(expression)
+    if not m:
+        raise ValueError(f'Cannot parse date expression {expression!r}')
+    if m.group('func'):
+        date = resolve_date(m.group('arg'), index_date)
+        return {
+            'first_day_of_month': date.replace(day=1),
+            'last_day_of_month': date + pd.offsets.MonthEnd(0),
+            'first_day_of_year': date.replace(month=1, day=1),
+            'last_day_of_year': date.replace(month=12, day=31),
+        }[m.group('func')]
+    base = m.group('base').strip()
+    date = pd.Timestamp(index_date if base == 'index_date' else base)
+    if m.group('n'):
+        n = int(m.group('n')) * (1 if m.group('sign') == '+' else -1)
+        unit = m.group('unit').rstrip('s')
+        date = date + (pd.Timedelta(days=n) if unit == 'day'
+                       else pd.DateOffset(months=n) if unit == 'month' else pd.DateOffset(years=n))
+    return date
+
+
+# Start and end (inclusive, None for open) of a variable's date window
+def variable_window(kwargs, index_date):
+    if kwargs.get('between'):
+        start, end = kwargs['between']
+        return resolve_date(start, index_date), resolve_date(end, index_date)
+    return resolve_date(kwargs.get('on_or_after'), index_date), resolve_date(kwargs.get('on_or_before'), index_date)
@@ -0,0 +1,121 @@
+import json
+import os
+import resource
+import sys
+import time
+
+from contextlib import contextmanager
+
+# Lightweight profiling for the analysis scripts and notebooks. Each stage
+# (a whole file, a month, or a step within a month) records its wall time,
+# CPU time, peak RSS, rows in and out and bytes read and written; the
+# records of a run are written as one JSON report into logs/, e.g.
+#
+#   with stage('aggregate', date='2020-01-01') as metrics:
+#       metrics['rows_in'] = len(df)
+#       ...
+#   write_report('generate_elev_predm_inputs')
+
+# Stages recorded in this process, in the order they finished
+stages = []
+
+# Names of the stages currently running, outermost first
+open_stages = []
+
+started = time.time()
+
+
+# Peak resident set size of this process so far, or of the process usage
+# was reported for (e.g. by os.wait4). ru_maxrss is in KiB on Linux but
+# bytes on macOS.
+def peak_rss_mb(usage=None):
+    rss = (usage or resource.getrusage(resource.RUSAGE_SELF)).ru_maxrss
+    return round(rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def cpu_seconds(who=resource.RUSAGE_SELF):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+# Total size of files, counting everything under a directory (e.g. a
+# dataset partition); missing paths count as 0
+def total_bytes(paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(root, file))
+                         for root, _, files in os.walk(path) for file in files)
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+# Time a block of work. inputs are measured before it runs and outputs
+# after, so a file rewritten in place counts on both sides. The yielded
+# dict takes rows_in/rows_out and any other counts the caller has; labels
+# (file, date, ...) identify the stage in the report.
+@contextmanager
+def stage(name, inputs=(), outputs=(), **labels):
+    metrics = {'rows_in': None, 'rows_out': None}
+    bytes_read = total_bytes(inputs)
+    rss_before = peak_rss_mb()
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+    parent = open_stages[-1] if open_stages else None
+    open_stages.append(name)
+    status = 'failed'
+    try:
+        yield metrics
+        status = 'ok'
+    finally:
+        open_stages.pop()
+        stages.append({
+            'stage': name,
+            'parent': parent,
+            **labels,
+            'status': status,
+            'pid': os.getpid(),
+            'wall_seconds': round(time.perf_counter() - start, 4),
+            'cpu_seconds': round(cpu_seconds() - cpu_before, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_growth_mb': round(peak_rss_mb() - rss_before, 1),
+            'bytes_read': bytes_read,
+            'bytes_written': total_bytes(outputs),
+            **metrics,
+        })
+
+
+# Pass frames through unchanged, adding their rows to metrics[key]
+def counted(frames, metrics, key):
+    metrics[key] = metrics[key] or 0
+    for df in frames:
+        metrics[key] += len(df)
+        yield df
+
+
+# Run func in a worker process and return its result together with the
+# stages it recorded, so the parent can include them in its report
+def with_stages(func, item):
+    first = len(stages)
+    result = func(item)
+    return result, stages[first:]
+
+
+# Write the stages recorded so far, with totals for the whole run, to
+# log_dir/<name>.json. Workers' CPU time is included once they have exited.
+# Written with json directly so that the notebooks can time their stages
+# without importing the extract readers.
+def write_report(name, log_dir='logs'):
+    os.makedirs(log_dir, exist_ok=True)
+    report = {
+        'name': name,
+        'argv': sys.argv,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'wall_seconds': round(time.time() - started, 4),
+        'cpu_seconds': round(cpu_seconds() + cpu_seconds(resource.RUSAGE_CHILDREN), 4),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+    }
+    with open(os.path.join(log_dir, f'{name}.json'), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
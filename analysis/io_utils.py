@@ -0,0 +1,342 @@
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import re
+import shutil
+import tempfile
+
+from contextlib import contextmanager
+from schema import apply_schema
+
+
+# Permissions a file or directory created with mode gets under the process
+# umask. mkstemp and mkdtemp create them readable by their owner only,
+# which os.replace would carry over to the final path.
+def umask_mode(mode):
+    umask = os.umask(0)
+    os.umask(umask)
+    return mode & ~umask
+
+
+# Write to a temporary file next to the target and rename it over the
+# original once complete, so a failed run never leaves a half-written file
+@contextmanager
+def atomic_path(file_path):
+    dir_name, base_name = os.path.split(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name or '.', prefix=f'.{base_name}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, umask_mode(0o666))
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# SHA-256 of a file's contents, read in blocks
+def file_hash(file_path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Manifest entry for a file: content hash plus size and mtime, which allow
+# unchanged files to be recognised without re-reading them
+def file_entry(file_path):
+    stat = os.stat(file_path)
+    return {'sha256': file_hash(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Check a file against its manifest entry, only hashing it when the size
+# matches but the mtime does not (e.g. after being copied)
+def matches_entry(file_path, entry):
+    if not entry or not os.path.exists(file_path):
+        return False
+    stat = os.stat(file_path)
+    if stat.st_size != entry['size']:
+        return False
+    if stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+    return file_hash(file_path) == entry['sha256']
+
+
+def read_json(file_path, default=None):
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(file_path, obj):
+    with atomic_path(file_path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f, indent=2, sort_keys=True)
+
+
+# Cohort extracts can be written by cohortextractor as CSV or feather; the
+# columnar formats keep dtypes and let readers load only the columns needed
+cohort_extensions = ['.feather', '.parquet', '.csv.gz', '.csv']
+
+
+def cohort_format(file_path):
+    for ext in cohort_extensions:
+        if file_path.endswith(ext):
+            return ext.split('.')[1]
+    raise ValueError(f'Unrecognised cohort file format: {file_path}')
+
+
+# Path of an extract given its name without extension, e.g.
+# 'output/data/input_ethnicity'
+def find_cohort_file(stem):
+    for ext in cohort_extensions:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    raise FileNotFoundError(f'No cohort file found for {stem}')
+
+
+# Monthly extracts for a study, e.g. 'all_patients', in date order
+def cohort_files(study, data_dir='output/data'):
+    pattern = re.compile(rf'^input_{study}_(\d{{4}}-\d{{2}}-\d{{2}})\.(feather|parquet|csv\.gz|csv)$')
+    matches = [pattern.match(file) for file in os.listdir(data_dir)]
+    return [os.path.join(data_dir, m.group(0))
+            for m in sorted(filter(None, matches), key=lambda m: m.group(1))]
+
+
+# Variables that do not depend on the index date, extracted once per
+# patient rather than into every monthly extract (local_extract.py
+# --fixed-once); None if the study has no such extract
+def fixed_file(study, data_dir='output/data'):
+    try:
+        return find_cohort_file(os.path.join(data_dir, f'input_{study}_fixed'))
+    except FileNotFoundError:
+        return None
+
+
+# Index date of a monthly extract, parsed once from its file name
+def file_date(file_path):
+    return pd.Timestamp(re.search(r'(\d{4}-\d{2}-\d{2})', os.path.basename(file_path)).group(1))
+
+
+# Read an extract, with the compact dtypes from schema unless typed=False
+def read_cohort(file_path, columns=None, typed=True):
+    fmt = cohort_format(file_path)
+    if fmt == 'feather':
+        df = pd.read_feather(file_path, columns=columns)
+    elif fmt == 'parquet':
+        df = pd.read_parquet(file_path, columns=columns)
+    else:
+        df = pd.read_csv(file_path, usecols=columns)
+    return apply_schema(df) if typed else df
+
+
+# Arrow schema of a columnar extract (None for CSV)
+def cohort_schema(file_path):
+    fmt = cohort_format(file_path)
+    if fmt == 'feather':
+        with pa.memory_map(file_path) as source:
+            return pa.ipc.open_file(source).schema
+    if fmt == 'parquet':
+        return pq.read_schema(file_path)
+    return None
+
+
+# Column names of an extract, without reading its rows
+def cohort_columns(file_path):
+    schema = cohort_schema(file_path)
+    if schema is not None:
+        return schema.names
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+# Read an extract as a sequence of frames of roughly chunk_size rows
+def iter_cohort_chunks(file_path, chunk_size, columns=None):
+    fmt = cohort_format(file_path)
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == 'feather':
+        # Record batches are decompressed one at a time from the mapped file
+        with pa.memory_map(file_path) as source:
+            reader = pa.ipc.open_file(source)
+            batches, n_rows = [], 0
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                batches.append(batch.select(columns) if columns else batch)
+                n_rows += batch.num_rows
+                if n_rows >= chunk_size:
+                    yield pa.Table.from_batches(batches).to_pandas()
+                    batches, n_rows = [], 0
+            if batches:
+                yield pa.Table.from_batches(batches).to_pandas()
+    else:
+        yield from pd.read_csv(file_path, chunksize=chunk_size, usecols=columns)
+
+
+# Real extracts hold plain string columns rather than categoricals
+def plain_strings(values):
+    if isinstance(values, pd.Categorical):
+        return np.asarray(values.categories, dtype=object)[values.codes]
+    return values
+
+
+# Write a sequence of frames to a single extract of the format implied by
+# file_path, replacing it atomically. Columnar formats use schema, where
+# given, so every chunk is written with the same column types. pandas
+# metadata is dropped so nullable integer columns read back as they would
+# from a CSV rather than as extension dtypes.
+def write_cohort_chunks(chunks, file_path, schema=None):
+    fmt = cohort_format(file_path)
+    if schema is not None:
+        schema = schema.remove_metadata()
+    with atomic_path(file_path) as tmp_path:
+        if fmt == 'csv':
+            compression = 'gzip' if file_path.endswith('.gz') else None
+            for i, df in enumerate(chunks):
+                df.to_csv(tmp_path, mode='w' if i == 0 else 'a', header=(i == 0),
+                          index=False, compression=compression)
+            return
+
+        writer = None
+        try:
+            for df in chunks:
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                table = table.replace_schema_metadata(None)
+                if writer is None:
+                    schema = table.schema
+                    writer = (pa.ipc.new_file(tmp_path, schema) if fmt == 'feather'
+                              else pq.ParquetWriter(tmp_path, schema))
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+# Monthly extracts consolidated into one parquet dataset per study, with
+# one date=YYYY-MM-DD partition per index date
+def dataset_dir(study, data_dir='output/data'):
+    return os.path.join(data_dir, study)
+
+
+def partition_path(study, date, data_dir='output/data'):
+    return os.path.join(dataset_dir(study, data_dir), f'date={pd.Timestamp(date):%Y-%m-%d}', 'part-0.parquet')
+
+
+def open_dataset(study, data_dir='output/data'):
+    partitioning = ds.partitioning(pa.schema([('date', pa.date32())]), flavor='hive')
+    return ds.dataset(dataset_dir(study, data_dir), format='parquet', partitioning=partitioning)
+
+
+# Index dates present in a consolidated dataset, in order; none if it has
+# not been consolidated
+def dataset_dates(study, data_dir='output/data'):
+    if not os.path.isdir(dataset_dir(study, data_dir)):
+        return []
+    return sorted(pd.Timestamp(d.split('=', 1)[1]) for d in os.listdir(dataset_dir(study, data_dir))
+                  if d.startswith('date='))
+
+
+# Remove the partitions of a study for index dates not in dates, e.g. left
+# by an earlier run for a month no longer extracted, so readers never see
+# them
+def remove_stale_partitions(study, dates, data_dir='output/data'):
+    dates = set(map(pd.Timestamp, dates))
+    stale = [date for date in dataset_dates(study, data_dir) if date not in dates]
+    for date in stale:
+        shutil.rmtree(os.path.dirname(partition_path(study, date, data_dir)))
+    return stale
+
+
+# Patient attributes that never change are kept out of the monthly
+# partitions and stored once per patient as a directory of .npy arrays
+# indexed by patient_key (categoricals as codes into the categories listed
+# in columns.json), which readers memory-map and index by key
+def dimension_dir(study, data_dir='output/data'):
+    return os.path.join(data_dir, f'{study}_patients')
+
+
+# Replace a study's patient dimension with the columns of df, whose rows
+# are every patient_key in order. The arrays are written to a temporary
+# directory and renamed into place, so readers never see a partial
+# dimension.
+def write_dimension(df, study, data_dir='output/data'):
+    final_dir = dimension_dir(study, data_dir)
+    tmp_dir = tempfile.mkdtemp(dir=data_dir, prefix=f'.{study}_patients.')
+    try:
+        columns = {}
+        for col in df.columns.drop('patient_key'):
+            series = df[col].astype('category') if pd.api.types.is_string_dtype(df[col].dtype) else df[col]
+            if series.dtype.name == 'category':
+                values = series.cat.codes.to_numpy()
+                columns[col] = {'categories': series.cat.categories.tolist()}
+            else:
+                values = series.to_numpy()
+                columns[col] = {}
+            np.save(os.path.join(tmp_dir, f'{col}.npy'), values)
+        write_json(os.path.join(tmp_dir, 'columns.json'), columns)
+        os.chmod(tmp_dir, umask_mode(0o777))
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# Columns of a study's patient dimension, with their categories; empty if
+# it has none
+def dimension_columns(study, data_dir='output/data'):
+    return read_json(os.path.join(dimension_dir(study, data_dir), 'columns.json'), {})
+
+
+# patient_id by patient_key, kept in the dimension so actions that only
+# read the consolidated dataset have the key map too
+def dimension_patient_ids(study, data_dir='output/data'):
+    return np.load(os.path.join(dimension_dir(study, data_dir), 'patient_id.npy'), mmap_mode='r')
+
+
+# Add dimension columns to rows of the study by indexing the mapped arrays
+# with each row's patient_key
+def attach_dimension(df, study, columns, data_dir='output/data'):
+    path = dimension_dir(study, data_dir)
+    meta = dimension_columns(study, data_dir)
+    keys = df['patient_key'].to_numpy()
+    for col in columns:
+        values = np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r')[keys]
+        categories = meta[col].get('categories')
+        df[col] = pd.Categorical.from_codes(values, categories) if categories is not None else values
+    return df
+
+
+# Read a consolidated dataset with a native date column. start and end
+# (inclusive) prune whole partitions rather than filtering rows. Columns
+# held in the patient dimension are attached to the rows read.
+def read_dataset(study, columns=None, start=None, end=None, data_dir='output/data', typed=True):
+    dataset = open_dataset(study, data_dir)
+    static = [col for col in dimension_columns(study, data_dir)
+              if col not in dataset.schema.names and (columns is None or col in columns)]
+    date_filter = None
+    if start is not None:
+        date_filter = ds.field('date') >= pa.scalar(pd.Timestamp(start).date(), pa.date32())
+    if end is not None:
+        end_filter = ds.field('date') <= pa.scalar(pd.Timestamp(end).date(), pa.date32())
+        date_filter = end_filter if date_filter is None else date_filter & end_filter
+    order = None
+    if columns is not None:
+        order = [col for col in columns if col != 'date'] + ['date']
+        columns = [col for col in order if col not in static]
+        if static and 'patient_key' not in columns:
+            columns.insert(0, 'patient_key')
+    table = dataset.to_table(columns=columns, filter=date_filter)
+    df = table.to_pandas(date_as_object=False)
+    if static:
+        df = attach_dimension(df, study, static, data_dir)
+        df = df[order or [col for col in df.columns if col != 'date'] + ['date']]
+    return apply_schema(df) if typed else df
+
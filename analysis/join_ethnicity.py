@@ -1,22 +1,165 @@
+import argparse
+import numpy as np
 import pandas as pd
 import os
-import sys
-
-# Pull in ethnicity file
-ethnicity_df = pd.read_csv('output/data/input_ethnicity.csv')
-
-for file in os.listdir('output/data'):
-    if file.startswith(f'{sys.argv[1]}'):
-        file_path = os.path.join('output/data', file)
-        df = pd.read_csv(file_path)
-        merged_df = df.merge(ethnicity_df, how='left', on='patient_id').set_index('patient_id')
-        
-        merged_df.to_csv(file_path)
-
-# for file in os.listdir('output/data'):
-#     if file == 'input.feather':
-#         file_path = os.path.join('output/data', file)
-#         df = pd.read_feather(file_path)
-#         merged_df = df.merge(ethnicity_df, how='left', on='patient_id')
-        
-#         merged_df.to_feather('output/data/input_joined.feather')
\ No newline at end of file
+import pyarrow as pa
+import re
+
+from config import workers
+from instrumentation import counted, stage, write_report
+from io_utils import (cohort_schema, file_entry, file_hash, find_cohort_file, iter_cohort_chunks,
+                      matches_entry, read_cohort, read_json, write_cohort_chunks, write_json)
+from parallel import map_files
+from patient_keys import (append_keys, build_keys, find_keys, key_frame, key_index, keys_path, lookup_keys,
+                          read_keys, sorted_unique, write_keys)
+
+# Rows read from each monthly extract at a time
+chunk_size = 500000
+
+
+# Build the ethnicity lookup once as the ethnicity columns indexed by
+# patient key, whether each key has an ethnicity row (the first row of each
+# patient is used), plus the index for looking keys up
+def load_ethnicity_index(study, file_path=None):
+    ethnicity_df = read_cohort(file_path or find_cohort_file('output/data/input_ethnicity'), typed=False)
+    ethnicity_df = ethnicity_df.drop_duplicates('patient_id', keep='first')
+    keys = read_keys(study)
+    index = key_index(keys)
+    by_key = key_frame(ethnicity_df, keys, ethnicity_df.columns.drop('patient_id'))
+    ethnicity_keys = find_keys(index, ethnicity_df['patient_id'])
+    found = np.zeros(len(keys), dtype=bool)
+    found[ethnicity_keys[ethnicity_keys >= 0]] = True
+    columns = {col: by_key[col].to_numpy() for col in by_key.columns if col != 'patient_key'}
+    return found, columns, index
+
+
+# Key each row of a chunk, then left join it onto the lookup by indexing
+# the ethnicity arrays with the key
+def join_chunk(df, index):
+    found_keys, columns, keys = index
+    patient_keys = lookup_keys(keys, df['patient_id'])
+    df['patient_key'] = patient_keys
+    found = found_keys[patient_keys]
+    for col, values in columns.items():
+        joined = pd.Series(values[patient_keys], index=df.index)
+        # Nullable integers keep unmatched patients blank without turning
+        # the whole column into floats in some chunks but not others
+        if joined.dtype.kind in 'iu':
+            joined = joined.astype('Int64')
+        df[col] = joined.where(found)
+    return df
+
+
+# Column types of the joined extract, so every chunk of a columnar file is
+# written with the same schema
+def joined_schema(file_path, index):
+    schema = cohort_schema(file_path)
+    if schema is None:
+        return None
+    fields = {col: pa.from_numpy_dtype(values.dtype) if values.dtype.kind in 'iufb' else pa.string()
+              for col, values in index[1].items()}
+    for col, field_type in {'patient_key': pa.int32(), **fields}.items():
+        field = pa.field(col, field_type)
+        i = schema.get_field_index(col)
+        schema = schema.set(i, field) if i >= 0 else schema.append(field)
+    return schema
+
+
+# Stream a monthly extract through the join into a temp file, then
+# rename it over the original
+def join_file(file_path, index):
+    with stage('join_file', [file_path], [file_path], file=os.path.basename(file_path)) as metrics:
+        chunks = counted(iter_cohort_chunks(file_path, chunk_size), metrics, 'rows_in')
+        chunks = counted((join_chunk(df, index) for df in chunks), metrics, 'rows_out')
+        write_cohort_chunks(chunks, file_path, joined_schema(file_path, index))
+
+
+# Record of which extracts have already been joined against which version
+# of the ethnicity extract and of the patient key map, so reruns only touch
+# new or changed months
+def manifest_path(prefix):
+    return os.path.join('output/data', f'join_ethnicity_{prefix}_manifest.json')
+
+
+# patient_ids of extracts, read one id column at a time
+def extract_ids(file_paths):
+    return np.concatenate([np.empty(0, dtype=np.int64)] +
+                          [sorted_unique(read_cohort(file_path, ['patient_id'], typed=False)['patient_id'])
+                           for file_path in file_paths])
+
+
+# patient_id by key for a study. Without a valid stored map, the ethnicity
+# extract's patients come first, then any others found in the extracts.
+# Otherwise the stored keys are kept and only patients of the extracts
+# being read (new or changed months, or the ethnicity extract if it has
+# changed) that are not yet keyed are given the next keys, so months
+# already joined keep their patient_key values.
+def study_keys(stored, file_paths, ethnicity_path=None):
+    if stored is None:
+        master = sorted_unique(read_cohort(ethnicity_path, ['patient_id'], typed=False)['patient_id'])
+        return build_keys(master, extract_ids(file_paths))
+    paths = file_paths + ([ethnicity_path] if ethnicity_path else [])
+    return append_keys(stored, extract_ids(paths))
+
+
+# Loaded once in the parent and inherited by forked workers
+ethnicity_index = None
+
+
+def init_worker(study):
+    global ethnicity_index
+    file_path = find_cohort_file('output/data/input_ethnicity')
+    with stage('load_ethnicity', [file_path, keys_path(study)]) as metrics:
+        ethnicity_index = load_ethnicity_index(study, file_path)
+        metrics['rows_in'] = int(ethnicity_index[0].sum())
+
+
+def join_worker(file_path):
+    join_file(file_path, ethnicity_index)
+    return file_entry(file_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('prefix')
+    parser.add_argument('--workers', type=int, default=workers)
+    parser.add_argument('--force', action='store_true', help='rejoin every file, ignoring the manifest')
+    args = parser.parse_args()
+
+    file_paths = [os.path.join('output/data', file) for file in sorted(os.listdir('output/data'))
+                  if file.startswith(args.prefix)]
+
+    # Skip months already joined against the current ethnicity extract and
+    # patient keys. The stored key map is only trusted if it is the one the
+    # manifest recorded.
+    study = re.sub(r'^input_', '', args.prefix)
+    ethnicity_path = find_cohort_file('output/data/input_ethnicity')
+    manifest = read_json(manifest_path(args.prefix), {})
+    ethnicity_sha256 = file_hash(ethnicity_path)
+    ethnicity_changed = manifest.get('ethnicity_sha256') != ethnicity_sha256
+    stored = read_keys(study) if not args.force and matches_entry(keys_path(study), manifest.get('keys')) else None
+    joined = {}
+    if stored is not None and not ethnicity_changed:
+        joined = {file: entry for file, entry in manifest.get('files', {}).items()
+                  if matches_entry(os.path.join('output/data', file), entry)}
+    pending = [file_path for file_path in file_paths if os.path.basename(file_path) not in joined]
+
+    # Key the patients of the pending months, appending to the stored map
+    read_ethnicity = stored is None or ethnicity_changed
+    with stage('patient_keys', pending + ([ethnicity_path] if read_ethnicity else []), [keys_path(study)]) as metrics:
+        keys = stored
+        if pending or stored is None:
+            keys = study_keys(stored, pending, ethnicity_path if read_ethnicity else None)
+        if stored is None or len(keys) != len(stored):
+            write_keys(keys, study)
+        metrics['rows_out'] = len(keys)
+
+    if pending:
+        # Pull in ethnicity file
+        init_worker(study)
+        entries = map_files(join_worker, pending, args.workers, initializer=init_worker, initargs=(study,))
+        joined.update(zip(map(os.path.basename, pending), entries))
+
+    write_json(manifest_path(args.prefix), {'ethnicity_sha256': ethnicity_sha256, 'keys': file_entry(keys_path(study)),
+                                            'files': joined})
+    write_report(f'join_ethnicity_{args.prefix}')
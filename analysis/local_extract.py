@@ -0,0 +1,376 @@
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import pyarrow.dataset as ds
+import sqlite3
+
+from config import events_dir
+from expressions import StudyColumns, variable_window
+from instrumentation import stage, write_report
+from io_utils import plain_strings, write_cohort_chunks
+from study_variables import all_variables, fixed_variables, study_codelists, study_variables
+
+# Local stand-in for cohortextractor generate_cohort --index-date-range,
+# building every monthly extract of a study from event-level tables in one
+# read rather than querying the tables again for each index date. Tables
+# are read from <events_dir>/<table>.parquet, or from tables of the same
+# names in <events_dir>/events.sqlite:
+#
+#   patients         patient_id, sex, date_of_birth
+#   registrations    patient_id, start_date, end_date, region
+#   addresses        patient_id, start_date, end_date, index_of_multiple_deprivation
+#   clinical_events  patient_id, date, code, numeric_value
+#   medications      patient_id, date, code
+#
+# Events are read once, restricted to the study's codelists, and sorted by
+# patient and date once. Each month's window of a variable is then found by
+# a binary search per patient in the sorted events, so the event tables are
+# scanned once for the whole date range. For example:
+#
+#   python analysis/local_extract.py --study-definition study_definition_all_patients \
+#       --index-date-range "2019-01-01 to 2021-06-01 by month" --output-format feather
+
+event_tables = {'with_these_clinical_events': 'clinical_events', 'with_these_medications': 'medications'}
+
+# Event keys are the patient's position in sorted patient_id order shifted
+# left by day_bits, plus the day's offset from day_epoch, so sorting the
+# keys sorts events by patient and then date
+day_epoch = np.datetime64('1800-01-01', 'D')
+day_bits = 17
+last_day = (1 << day_bits) - 1
+
+
+# Days since day_epoch of a column of dates, missing where not a date
+def day_offsets(values, missing):
+    dates = pd.to_datetime(pd.Series(values), errors='coerce').to_numpy().astype('datetime64[D]')
+    return np.where(np.isnat(dates), missing, (dates - day_epoch).astype(np.int64))
+
+
+def day_offset(date, missing):
+    if date is None:
+        return missing
+    return int((np.datetime64(pd.Timestamp(date).date(), 'D') - day_epoch).astype(np.int64))
+
+
+# Strings as a categorical with '' for missing (code -1), so expressions
+# compare codes rather than strings
+def with_missing(codes, labels):
+    return pd.Categorical.from_codes(np.asarray(codes) + 1, [''] + [label for label in labels])
+
+
+# Dates of matches as strings, '' for patients without one
+def date_strings(days, found, include_day=True):
+    dates = (day_epoch + days[found]).astype('datetime64[D]' if include_day else 'datetime64[M]')
+    codes, labels = pd.factorize(dates)
+    all_codes = np.full(len(days), -1, dtype=np.int64)
+    all_codes[found] = codes
+    return with_missing(all_codes, np.datetime_as_string(np.asarray(labels)))
+
+
+# Read columns of a table, keeping only rows whose code is in codes where
+# given. Parquet is filtered as it is read; SQLite through a temporary
+# table of the codes.
+def read_table(name, columns, codes=None, data_dir=None):
+    data_dir = data_dir or events_dir
+    path = os.path.join(data_dir, f'{name}.parquet')
+    if os.path.exists(path):
+        row_filter = ds.field('code').isin(sorted(codes)) if codes is not None else None
+        return ds.dataset(path).to_table(columns=columns, filter=row_filter).to_pandas()
+
+    with sqlite3.connect(os.path.join(data_dir, 'events.sqlite')) as conn:
+        query = f"SELECT {', '.join(columns)} FROM {name}"
+        if codes is not None:
+            conn.execute('CREATE TEMP TABLE wanted_codes (code TEXT PRIMARY KEY)')
+            conn.executemany('INSERT INTO wanted_codes VALUES (?)', [(code,) for code in sorted(codes)])
+            query += ' WHERE CAST(code AS TEXT) IN (SELECT code FROM wanted_codes)'
+        return pd.read_sql_query(query, conn)
+
+
+# Events of one table for the codelists a study uses, as sorted keys with
+# the code and value of each
+class Events:
+    def __init__(self, df, patient_ids, codelists):
+        pos = np.searchsorted(patient_ids, df['patient_id'].to_numpy(dtype=np.int64))
+        pos = np.minimum(pos, len(patient_ids) - 1)
+        known = patient_ids[pos] == df['patient_id'].to_numpy(dtype=np.int64)
+        keys = (pos.astype(np.int64) << day_bits) | day_offsets(df['date'], 0)
+        order = np.argsort(keys[known], kind='stable')
+        self.keys = keys[known][order]
+        # Codes are held as positions in the distinct codes, so matching a
+        # codelist tests each distinct code once rather than every event
+        self.code_ids, self.code_labels = pd.factorize(df['code'].astype(str).to_numpy(dtype=object)[known][order])
+        values = df['numeric_value'] if 'numeric_value' in df.columns else pd.Series(np.zeros(len(df)))
+        self.values = values.to_numpy(dtype=np.float64)[known][order]
+        self.codelists = codelists
+        self.matches = {}
+
+    # Events with a code in the codelist, still in key order
+    def matching(self, codelist):
+        if codelist not in self.matches:
+            codes = self.codelists[codelist]
+            mask = pd.Series(self.code_labels).isin(codes['codes']).to_numpy()[self.code_ids]
+            categories = None
+            if codes['categories'] is not None:
+                lookup = dict(zip(codes['codes'], codes['categories']))
+                labels = np.array([lookup.get(code, '') for code in self.code_labels], dtype=object)
+                categories = labels[self.code_ids[mask]]
+            self.matches[codelist] = (self.keys[mask], self.values[mask], categories)
+        return self.matches[codelist]
+
+
+# Periods (registrations, addresses) of each patient with the value held
+# over each, in start date order
+class Periods:
+    def __init__(self, df, patient_ids, value_col):
+        pos = np.searchsorted(patient_ids, df['patient_id'].to_numpy(dtype=np.int64))
+        pos = np.minimum(pos, len(patient_ids) - 1)
+        known = patient_ids[pos] == df['patient_id'].to_numpy(dtype=np.int64)
+        start = day_offsets(df['start_date'], 0)
+        order = np.lexsort((start[known], pos[known]))
+        self.patients = pos[known][order]
+        self.start = start[known][order]
+        self.end = day_offsets(df['end_date'], last_day)[known][order]
+        values = df[value_col].to_numpy()[known][order]
+        # Strings are held as codes
+        self.labels = None
+        if values.dtype == object:
+            values, self.labels = pd.factorize(pd.Series(values).replace('', None))
+        self.values = values
+
+    # Whether each patient has a period covering the date, and the value of
+    # the latest starting one (missing, or '' for strings, where none does)
+    def as_of(self, date, n, missing=0):
+        day = day_offset(date, last_day)
+        active = (self.start <= day) & (self.end >= day)
+        covered = np.zeros(n, dtype=bool)
+        covered[self.patients[active]] = True
+        values = np.full(n, -1 if self.labels is not None else missing, dtype=self.values.dtype)
+        # Periods are in start order, so the latest written wins
+        values[self.patients[active]] = self.values[active]
+        return covered, with_missing(values, self.labels) if self.labels is not None else values
+
+
+# The event-level tables for a study's patients, read once
+class Tables:
+    def __init__(self, specs, data_dir=None):
+        codelists = study_codelists()
+        patients = read_table('patients', ['patient_id', 'sex', 'date_of_birth'], data_dir=data_dir)
+        patients = patients.sort_values('patient_id', kind='stable')
+        self.patient_ids = patients['patient_id'].to_numpy(dtype=np.int64)
+        self.sex = with_missing(*pd.factorize(patients['sex'].replace('', None)))
+        self.date_of_birth = patients['date_of_birth'].to_numpy()
+
+        self.events = {}
+        for table in set(event_tables.values()):
+            used = {spec['args'][0]['codelist'] for spec in specs.values()
+                    if event_tables.get(spec['function']) == table}
+            if not used:
+                continue
+            with stage('read_events', table=table) as metrics:
+                codes = {code for codelist in used for code in codelists[codelist]['codes']}
+                columns = ['patient_id', 'date', 'code'] + (['numeric_value'] if table == 'clinical_events' else [])
+                df = read_table(table, columns, codes, data_dir)
+                metrics['rows_in'] = len(df)
+                self.events[table] = Events(df, self.patient_ids, codelists)
+
+        functions = {spec['function'] for spec in specs.values()}
+        if functions & {'registered_as_of', 'registered_practice_as_of'}:
+            self.registrations = Periods(read_table('registrations', ['patient_id', 'start_date', 'end_date', 'region'],
+                                                    data_dir=data_dir), self.patient_ids, 'region')
+        if 'address_as_of' in functions:
+            self.addresses = Periods(read_table('addresses', ['patient_id', 'start_date', 'end_date',
+                                                              'index_of_multiple_deprivation'], data_dir=data_dir),
+                                     self.patient_ids, 'index_of_multiple_deprivation')
+
+
+# patients.* functions local extraction computes; categorised_as and
+# satisfying variables are evaluated from the variables they refer to
+supported_functions = set(event_tables) | {'all', 'sex', 'age_as_of', 'registered_as_of', 'registered_practice_as_of',
+                                           'address_as_of', 'categorised_as', 'satisfying'}
+
+
+# Fail before any table is read if a study uses a function local
+# extraction does not support (e.g. with_ethnicity_from_sus), naming the
+# variables that do
+def check_supported(study, specs):
+    unsupported = {name: spec['function'] for name, spec in specs.items()
+                   if spec['function'] not in supported_functions}
+    if unsupported:
+        raise ValueError(f'study_definition_{study} cannot be extracted locally; unsupported variables: ' +
+                         ', '.join(f'{name} ({function})' for name, function in unsupported.items()))
+
+
+# Event variables grouped by the table and codelist they query. Variables
+# of a group (e.g. took_hba1c, hba1c_mmol_per_mol and prev_hba1c_mmol_per_mol
+# on hba1c_new_codes) are answered from the same matched events, with the
+# bounds of all their windows found in one search.
+def plan_queries(specs):
+    groups = {}
+    for name, spec in specs.items():
+        if spec['function'] in event_tables:
+            groups.setdefault((event_tables[spec['function']], spec['args'][0]['codelist']), []).append(name)
+    return groups
+
+
+# Columns of one month's cohort over every patient, computed from the
+# tables
+class LocalColumns(StudyColumns):
+    def __init__(self, specs, tables, index_date):
+        super().__init__(specs, len(tables.patient_ids))
+        self.tables, self.index_date = tables, index_date
+        self.groups = plan_queries(specs)
+        self.windows = {}
+
+    def query(self, name, spec):
+        function, kwargs = spec['function'], spec['kwargs']
+        date = spec['args'][0] if spec['args'] else None
+        date = self.index_date if date == 'index_date' else date
+        if function in event_tables:
+            return self.query_events(name, spec)
+        if function == 'all':
+            return np.ones(self.n, dtype=np.int64)
+        if function == 'sex':
+            return self.tables.sex
+        if function == 'age_as_of':
+            return self.age_as_of(pd.Timestamp(date))
+        if function == 'registered_as_of':
+            return self.tables.registrations.as_of(date, self.n)[0].astype(np.int64)
+        if function == 'registered_practice_as_of':
+            return self.tables.registrations.as_of(date, self.n)[1]
+        if function == 'address_as_of':
+            values = self.tables.addresses.as_of(date, self.n, 0)[1].astype(np.float64)
+            rounding = kwargs.get('round_to_nearest', 1)
+            return ((values / rounding).round() * rounding).astype(np.int64)
+        raise ValueError(f'{function} is not supported by local extraction')
+
+    def age_as_of(self, date):
+        birth = pd.to_datetime(pd.Series(self.tables.date_of_birth), errors='coerce')
+        months = (date.year - birth.dt.year) * 12 + (date.month - birth.dt.month) - (date.day < birth.dt.day)
+        return (months // 12).fillna(0).to_numpy(dtype=np.int64)
+
+    # First and one past the last matching event of each patient within the
+    # window. The first variable of a group to be queried finds the bounds of
+    # every distinct window of the group, patient by window, in one search.
+    def window(self, table, codelist, kwargs):
+        group = (table, codelist)
+        if group not in self.windows:
+            periods = list(dict.fromkeys(variable_window(self.specs[name]['kwargs'], self.index_date)
+                                         for name in self.groups[group]))
+            keys = self.tables.events[table].matching(codelist)[0]
+            base = (np.arange(self.n, dtype=np.int64) << day_bits)[:, None]
+            starts = np.array([day_offset(start, 0) for start, _ in periods], dtype=np.int64)
+            ends = np.array([day_offset(end, last_day) for _, end in periods], dtype=np.int64)
+            lo = np.searchsorted(keys, (base + starts).ravel(), 'left').reshape(self.n, -1)
+            hi = np.searchsorted(keys, (base + ends).ravel(), 'right').reshape(self.n, -1)
+            self.windows[group] = {period: (lo[:, i], hi[:, i]) for i, period in enumerate(periods)}
+        return self.windows[group][variable_window(kwargs, self.index_date)]
+
+    def query_events(self, name, spec):
+        kwargs = spec['kwargs']
+        table, codelist = event_tables[spec['function']], spec['args'][0]['codelist']
+        keys, values, categories = self.tables.events[table].matching(codelist)
+        lo, hi = self.window(table, codelist, kwargs)
+        count = hi - lo
+        found = count > 0
+        first = kwargs.get('find_first_match_in_period') or kwargs.get('return_first_date_in_period')
+        match = np.where(found, lo if first else hi - 1, 0)
+        days = keys[match] & last_day if len(keys) else np.zeros(self.n, dtype=np.int64)
+
+        if kwargs.get('include_date_of_match'):
+            self[f'{name}_date_measured'] = date_strings(days, found)
+        returning = kwargs.get('returning', 'binary_flag')
+        if returning == 'date' or kwargs.get('return_last_date_in_period') or kwargs.get('return_first_date_in_period'):
+            include_day = not kwargs.get('include_month') or kwargs.get('include_day')
+            return date_strings(days, found, include_day)
+        if returning == 'number_of_matches_in_period':
+            return count
+        if returning == 'numeric_value':
+            return np.where(found, values[match] if len(values) else 0.0, 0.0)
+        if returning == 'category':
+            codes, labels = pd.factorize(categories[match[found]])
+            all_codes = np.full(self.n, -1, dtype=np.int64)
+            all_codes[found] = codes
+            return with_missing(all_codes, labels)
+        return found.astype(np.int64)
+
+
+# Rows of the patients at positions rows with the named output variables
+def output_frame(columns, names, rows):
+    df = pd.DataFrame({'patient_id': columns.tables.patient_ids[rows]})
+    for name in names:
+        df[name] = plain_strings(columns[name])[rows]
+        if f'{name}_date_measured' in columns:
+            df[f'{name}_date_measured'] = plain_strings(columns[f'{name}_date_measured'])[rows]
+    return df
+
+
+# One month's extract: the population's rows with every output variable
+# except those in fixed, and the positions of the population's patients
+def extract_month(variables, tables, index_date, fixed=()):
+    columns = LocalColumns(all_variables(variables), tables, index_date)
+    population = np.flatnonzero(columns['population'] != 0) if 'population' in variables \
+        else np.arange(columns.n)
+    names = [name for name in variables if name != 'population' and name not in fixed]
+    return output_frame(columns, names, population), population
+
+
+# Index dates of an --index-date-range such as
+# "2019-01-01 to 2021-06-01 by month", or of a single date
+def index_dates(date_range):
+    parts = date_range.split()
+    if len(parts) == 1:
+        return [pd.Timestamp(parts[0])]
+    start, _, end, _, period = parts
+    return list(pd.date_range(start, end, freq={'month': 'MS', 'week': '7D'}[period]))
+
+
+# Extract every month of a study. With fixed_once, output variables that
+# do not depend on the index date are left out of the monthly extracts and
+# written once, for every patient in any month's population, to
+# input_<study>_fixed, which consolidation joins back on by patient.
+def extract_study(study, dates, output_dir='output/data', fmt='feather', data_dir=None, fixed_once=False):
+    variables = study_variables(study)
+    check_supported(study, all_variables(variables))
+    with stage('read_tables', study=study):
+        tables = Tables(all_variables(variables), data_dir)
+    fixed = [name for name in fixed_variables(all_variables(variables))
+             if name in variables and name != 'population'] if fixed_once else []
+    os.makedirs(output_dir, exist_ok=True)
+    seen = np.zeros(len(tables.patient_ids), dtype=bool)
+    for date in dates:
+        out_path = os.path.join(output_dir, f'input_{study}_{date:%Y-%m-%d}.{fmt}')
+        with stage('extract_month', outputs=[out_path], date=f'{date:%Y-%m-%d}') as metrics:
+            df, population = extract_month(variables, tables, f'{date:%Y-%m-%d}', fixed)
+            write_cohort_chunks([df], out_path)
+            seen[population] = True
+            metrics['rows_out'] = len(df)
+
+    if fixed:
+        out_path = os.path.join(output_dir, f'input_{study}_fixed.{fmt}')
+        with stage('extract_fixed', outputs=[out_path], variables=fixed) as metrics:
+            columns = LocalColumns(all_variables(variables), tables, f'{dates[0]:%Y-%m-%d}')
+            df = output_frame(columns, fixed, np.flatnonzero(seen))
+            write_cohort_chunks([df], out_path)
+            metrics['rows_out'] = len(df)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--study-definition', required=True, help='e.g. study_definition_all_patients')
+    parser.add_argument('--index-date-range', required=True)
+    parser.add_argument('--output-dir', default='output/data')
+    parser.add_argument('--output-format', default='feather', choices=['feather', 'parquet', 'csv.gz', 'csv'])
+    parser.add_argument('--events-dir', default=events_dir)
+    parser.add_argument('--fixed-once', action='store_true',
+                        help='extract variables that do not depend on the index date once per patient')
+    args = parser.parse_args()
+
+    study = args.study_definition.replace('study_definition_', '', 1)
+    try:
+        check_supported(study, all_variables(study_variables(study)))
+    except ValueError as e:
+        parser.error(str(e))
+    extract_study(study, index_dates(args.index_date_range), args.output_dir, args.output_format, args.events_dir,
+                  args.fixed_once)
+    write_report(f'local_extract_{study}')
@@ -0,0 +1,25 @@
+from config import demographics, measure_demographic_ids, measure_numerators
+
+# Measures are declared as a matrix of numerators (one per threshold, plus
+# all tests) by groupings (diabetes type alone, then diabetes type and each
+# demographic), all computed by calculate_measures.py.
+
+
+def measure_matrix():
+    measures = []
+    for prefix, numerator in measure_numerators.items():
+        measures.append(dict(
+            id=f"{prefix}_by_dm",
+            numerator=numerator,
+            denominator="population",
+            group_by=["diabetes_type"],
+        ))
+    for prefix, numerator in measure_numerators.items():
+        for demographic in demographics:
+            measures.append(dict(
+                id=f"{prefix}_by_dm_and_{measure_demographic_ids.get(demographic, demographic)}",
+                numerator=numerator,
+                denominator="population",
+                group_by=["diabetes_type", demographic],
+            ))
+    return measures
@@ -0,0 +1,27 @@
+import multiprocessing as mp
+
+from functools import partial
+from instrumentation import stages, with_stages
+
+
+# Apply func to each item, across a pool of worker processes when more than
+# one worker is requested. Workers are forked where the platform allows it,
+# so anything loaded at module level before the call (e.g. lookup arrays)
+# is shared read-only with the workers instead of being pickled to each.
+# On platforms without fork, initializer is run in every worker instead.
+def map_files(func, items, workers=1, initializer=None, initargs=()):
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    if 'fork' in mp.get_all_start_methods():
+        ctx, initializer, initargs = mp.get_context('fork'), None, ()
+    else:
+        ctx = mp.get_context('spawn')
+
+    # Stages recorded by the workers are added to this process's report
+    with ctx.Pool(min(workers, len(items)), initializer, initargs) as pool:
+        results = pool.map(partial(with_stages, func), items, chunksize=1)
+    for _, worker_stages in results:
+        stages.extend(worker_stages)
+    return [result for result, _ in results]
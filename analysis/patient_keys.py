@@ -0,0 +1,91 @@
+import numpy as np
+import os
+import pandas as pd
+
+from io_utils import atomic_path
+
+# Dense surrogate keys 0..N-1 for the patients of a study, stored with the
+# extracts as a patient_key column, so patient-level joins, sets and
+# per-patient arrays index by key rather than searching or hashing sparse
+# patient_ids. When first built, keys follow the ethnicity extract
+# (population=patients.all()) in patient_id order, with patients of the
+# monthly extracts missing from it (e.g. in dummy data) after them. Keys
+# are never reassigned: patients first seen later are appended. The map,
+# patient_id by key, is kept in output/data/patient_keys_<study>.npy.
+
+
+def keys_path(study, data_dir='output/data'):
+    return os.path.join(data_dir, f'patient_keys_{study}.npy')
+
+
+# Sorted distinct ids, by sorting rather than np.unique, which hashes
+def sorted_unique(patient_ids):
+    patient_ids = np.sort(np.asarray(patient_ids, dtype=np.int64))
+    return patient_ids[np.r_[True, patient_ids[1:] != patient_ids[:-1]]] if len(patient_ids) else patient_ids
+
+
+# patient_id by key: the master ids, then any other ids not among them
+def build_keys(master_ids, other_ids):
+    master_ids = sorted_unique(master_ids)
+    other_ids = sorted_unique(other_ids)
+    pos = np.minimum(np.searchsorted(master_ids, other_ids), max(len(master_ids) - 1, 0))
+    known = master_ids[pos] == other_ids if len(master_ids) else np.zeros(len(other_ids), dtype=bool)
+    return np.concatenate([master_ids, other_ids[~known]])
+
+
+# The map with the ids not already in it appended after the existing keys,
+# in id order, so every patient already keyed keeps their key
+def append_keys(keys, patient_ids):
+    patient_ids = sorted_unique(patient_ids)
+    new = find_keys(key_index(keys), patient_ids) < 0
+    return np.concatenate([np.asarray(keys, dtype=np.int64), patient_ids[new]])
+
+
+def read_keys(study, data_dir='output/data'):
+    path = keys_path(study, data_dir)
+    return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+
+def write_keys(keys, study, data_dir='output/data'):
+    with atomic_path(keys_path(study, data_dir)) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, keys)
+
+
+# Sorted ids and the key of each, for looking keys up by binary search
+def key_index(keys):
+    order = np.argsort(keys, kind='stable')
+    return np.asarray(keys)[order], order
+
+
+# Key of each patient_id, -1 for ids not in the map
+def find_keys(index, patient_ids):
+    sorted_ids, order = index
+    patient_ids = np.asarray(patient_ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.full(len(patient_ids), -1, dtype=np.int32)
+    pos = np.minimum(np.searchsorted(sorted_ids, patient_ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == patient_ids, order[pos], -1).astype(np.int32)
+
+
+# Key of each patient_id. Every id must be in the map.
+def lookup_keys(index, patient_ids):
+    keys = find_keys(index, patient_ids)
+    if (keys < 0).any():
+        raise ValueError('patient_id missing from the patient key map; rerun join_ethnicity.py')
+    return keys
+
+
+# Columns of a frame with one row per patient_id as a frame with one row
+# per key of the map, in key order. Patients without a row get 0 or '';
+# rows of patients not in the map are dropped.
+def key_frame(df, keys, columns):
+    found = find_keys(key_index(keys), df['patient_id'])
+    rows = found >= 0
+    df_out = pd.DataFrame({'patient_key': np.arange(len(keys), dtype=np.int32)})
+    for col in columns:
+        values = df[col].to_numpy()
+        column = np.full(len(keys), '' if values.dtype == object else 0, dtype=values.dtype)
+        column[found[rows]] = values[rows]
+        df_out[col] = column
+    return df_out
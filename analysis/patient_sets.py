@@ -0,0 +1,48 @@
+import numpy as np
+
+from functools import reduce
+
+# Sets of patients as bitmaps over patient_key (bit i set for the patient
+# with key i), packed eight patients to a byte. Sets built from each
+# month's rows are combined with bitwise set algebra, so unique patient
+# counts over the whole study period come from the bitmaps rather than from
+# hashing every row again. Keys are dense, so a bitmap of 25 million
+# patients takes about 3 MB.
+
+# Set bits in each byte value
+popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def patient_set(patient_keys):
+    patient_keys = np.asarray(patient_keys, dtype=np.int64)
+    bits = np.zeros(int(patient_keys.max()) + 1 if len(patient_keys) else 0, dtype=bool)
+    bits[patient_keys] = True
+    return np.packbits(bits)
+
+
+# Pad bitmaps to a common length, as ids beyond a bitmap's end are not in
+# the set
+def aligned(*sets):
+    n = max(len(s) for s in sets)
+    return [np.pad(s, (0, n - len(s))) for s in sets]
+
+
+def union(*sets):
+    return reduce(np.bitwise_or, aligned(*sets))
+
+
+def intersection(*sets):
+    return reduce(np.bitwise_and, aligned(*sets))
+
+
+def difference(a, b):
+    a, b = aligned(a, b)
+    return a & ~b
+
+
+def count(patients):
+    return int(popcount[patients].sum(dtype=np.int64))
+
+
+def patient_keys(patients):
+    return np.flatnonzero(np.unpackbits(patients))
@@ -1,23 +1,54 @@
+import argparse
 import pandas as pd
 import os
-import sys
 
-for file in os.listdir('output/data'):
-    if file.startswith('measure'):
-        file_path = os.path.join('output/data', file)
+from cache import add_cache_argument, cached_outputs, set_enabled
+from config import measure_numerators, suppression, workers
+from instrumentation import stage, write_report
+from parallel import map_files
+from suppression import suppress
+
+
+# Numerator of a measure from its file name, e.g. measure_tests_gt48_by_dm.csv
+def measure_numerator(file):
+    measure_id = file[len('measure_'):]
+    for prefix, numerator in measure_numerators.items():
+        if measure_id.startswith(prefix):
+            return numerator
+    return None
+
+
+def redact_file(file_path):
+    file = os.path.basename(file_path)
+    with stage('redact_file', [file_path], [file_path], file=file) as metrics:
         df = pd.read_csv(file_path)
-        # Drop rows if population <= 5
-        df = df.loc[df.population > 5]
-        # Drop rows if HbA1c test counts <= 5
-        if file.startswith('measure_total'):
-            df = df.loc[df.took_hba1c > 5]
-        elif file.startswith('measure_tests_gt48'):
-            df = df.loc[df.hba1c_gt_48 > 5]
-        elif file.startswith('measure_tests_gt58'):
-            df = df.loc[df.hba1c_gt_58 > 5]
-        elif file.startswith('measure_tests_gt64'):
-            df = df.loc[df.hba1c_gt_64 > 5]
-        elif file.startswith('measure_tests_gt75'):
-            df = df.loc[df.hba1c_gt_75 > 5]
-
-        df.to_csv(file_path)
\ No newline at end of file
+        metrics['rows_in'] = len(df)
+        # Drop rows if population or HbA1c test counts <= 5
+        numerator = measure_numerator(file)
+        counts = ['population'] + ([numerator] if numerator else [])
+        df = suppress(df, counts, by='date' if 'date' in df.columns else None)
+        # Keep the rate consistent with rounded counts
+        if suppression['rounding'] and numerator and 'value' in df.columns:
+            df['value'] = df[numerator] / df['population']
+
+        df.to_csv(file_path)
+        metrics['rows_out'] = len(df)
+
+
+# Measures calculated the same as in a previous run are restored from the
+# cache rather than redacted again
+def cached_redact_file(file_path):
+    cached_outputs(redact_file, [file_path], [file_path], file_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=workers)
+    add_cache_argument(parser)
+    args = parser.parse_args()
+    set_enabled(args.cache)
+
+    file_paths = [os.path.join('output/data', file) for file in sorted(os.listdir('output/data'))
+                  if file.startswith('measure')]
+    map_files(cached_redact_file, file_paths, args.workers)
+    write_report('redact_measures')
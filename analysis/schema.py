@@ -0,0 +1,104 @@
+import pandas as pd
+
+from study_variables import expected_ratios, study_variables
+
+# Compact in-memory dtypes for cohort columns, derived from the study
+# definitions: categoricals for enumerations, int8 for 0/1 flags and
+# float32 for measured values. Columns not listed keep their read dtype.
+
+studies = ['all_patients', 'prepandemic', 'ethnicity']
+
+flag_returning = ['binary_flag']
+count_returning = ['number_of_matches_in_period']
+value_returning = ['numeric_value']
+
+
+def is_numeric_category(value):
+    return str(value).lstrip('-').isdigit()
+
+
+# Declared categories of a variable, or None if it is not an enumeration
+def variable_categories(spec):
+    if spec['function'] == 'categorised_as':
+        return list(spec['args'][0])
+    return expected_ratios(spec)
+
+
+def variable_dtype(spec):
+    function, kwargs = spec['function'], spec['kwargs']
+    categories = variable_categories(spec)
+
+    if function in ('satisfying', 'registered_as_of'):
+        return 'flag'
+    if categories is not None:
+        if set(map(str, categories)) == {'0', '1'}:
+            return 'flag'
+        if all(map(is_numeric_category, categories)):
+            return ('category', sorted(int(c) for c in categories))
+        return ('category', sorted(categories))
+    if function in ('with_these_clinical_events', 'with_these_medications'):
+        returning = kwargs.get('returning', 'binary_flag')
+        if any(kwargs.get(k) for k in ('return_last_date_in_period', 'return_first_date_in_period')):
+            return None
+        if returning in flag_returning:
+            return 'flag'
+        if returning in count_returning:
+            return 'int32'
+        if returning in value_returning:
+            return 'float32'
+    return None
+
+
+def build_schema():
+    schema = {}
+    for study in studies:
+        for name, spec in study_variables(study).items():
+            if name != 'population':
+                schema[name] = variable_dtype(spec)
+    return {name: dtype for name, dtype in schema.items() if dtype is not None}
+
+
+cohort_schema = build_schema()
+
+
+# Strings read_csv reads as missing by default. The extracts used to be
+# read from CSV, where values such as mental_illness's "None" category were
+# missing and left out of every grouping, so they are read as missing from
+# feather and parquet too.
+csv_missing = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+               '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+
+# Categories in sorted order, so groupby output is ordered as it was for
+# the plain columns. Values the study definition did not anticipate (e.g.
+# regions missing from return_expectations) are kept rather than lost.
+def categorical(series, declared):
+    numeric = isinstance(declared[0], int)
+    if not numeric:
+        declared = [category for category in declared if category not in csv_missing]
+    if series.dtype.name == 'category':
+        if not numeric:
+            series = series.cat.remove_categories([c for c in series.cat.categories if c in csv_missing])
+        return series.cat.set_categories(sorted(set(declared) | set(series.cat.categories)))
+    if numeric:
+        series = pd.to_numeric(series, errors='coerce')
+    else:
+        series = series.where(series.isna(), series.astype(str))
+        series = series.where(~series.isin(csv_missing))
+    observed = series.dropna().unique()
+    categories = sorted(set(declared) | set(int(v) for v in observed) if numeric
+                        else set(declared) | set(observed))
+    return series.astype(pd.CategoricalDtype(categories))
+
+
+def apply_schema(df, schema=cohort_schema):
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype in ('flag', 'int32'):
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int8' if dtype == 'flag' else dtype)
+        elif isinstance(dtype, tuple):
+            df[col] = categorical(df[col], dtype[1])
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    return df
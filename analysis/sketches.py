@@ -0,0 +1,51 @@
+import numpy as np
+
+# Fixed-bin HbA1c histograms. Bin k holds values in (k - 1, k] mmol/mol for
+# k = 1..max_bin, bin 0 holds values <= 0 (no test recorded) and bin
+# max_bin + 1 everything above max_bin. Because the bins never change,
+# histograms of months or cohort segments merge by adding counts and serve
+# as quantile sketches accurate to within a bin, so distributions and
+# median/IQR can be drawn from a few thousand counts rather than raw rows.
+# The NICE thresholds fall on bin edges, so "> t" segments are the bins
+# above t.
+
+max_bin = 200
+
+
+# Bin of each value, NaN where the value is missing
+def hba1c_bin(values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), np.nan, np.clip(np.ceil(values), 0, max_bin + 1))
+
+
+def bin_start(bins):
+    return np.asarray(bins, dtype=np.float64) - 1
+
+
+def bin_end(bins):
+    return np.asarray(bins, dtype=np.float64)
+
+
+# Counts per bin of a histogram held as a frame of bin and count columns
+# (e.g. a subset of the sketch cells), summed over everything else
+def merge_histograms(df, bin_col='hba1c_bin', count_col='count'):
+    return df.groupby(bin_col, sort=True)[count_col].sum()
+
+
+# Quantiles of a histogram, interpolating linearly within the bin each
+# falls in. Bins at or below exclude_below are left out, e.g. 0 to drop
+# patients without a test.
+def histogram_quantiles(hist, qs, exclude_below=0):
+    hist = hist[(hist.index > exclude_below) & (hist > 0)]
+    counts = hist.to_numpy(dtype=np.float64)
+    total = counts.sum()
+    if total == 0:
+        return [np.nan] * len(qs)
+    cumulative = np.cumsum(counts)
+    out = []
+    for q in qs:
+        i = int(np.searchsorted(cumulative, q * total))
+        below = cumulative[i - 1] if i else 0.0
+        fraction = (q * total - below) / counts[i]
+        out.append(bin_start(hist.index[i]) + fraction)
+    return out
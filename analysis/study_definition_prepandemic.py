@@ -12,40 +12,32 @@ from cohortextractor import (
     Measure,
 )
 
-from common_variables import (
-    common_variables
-)
-
 from codelists import *
 
 ######################
 #  Study definition  #
 ######################
 
-# Define start and end dates
+# Prepandemic HbA1c and prediabetes of the patients in the elev_predm
+# cohort, extracted once rather than for every month: none of these
+# variables depend on the index date. derive_elev_predm.py builds the
+# monthly elev_predm data from the all_patients dataset and this extract.
 
 study = StudyDefinition(
-    
+
     # Set time period
     default_expectations={
         "date": {"earliest": "1900-01-01", "latest": "today"},
         "rate": "uniform",
         "incidence": 0.2,
     },
-    
-    # Limiting to patients who had an HbA1c test 
+
+    # Limiting to patients with elevated HbA1c or prediabetes pre-pandemic
     population=patients.satisfying(
         """
-        registered AND
-        (sex = 'M' OR sex = 'F') AND
-        (age >= 16 AND age <= 110) AND
-        (diabetes_type != 'UNKNOWN_DM') AND
-        (region != '') AND 
-        (prev_elevated_48 OR prepandemic_prediabetes)
-        """,
-        # Indicator for registration
-        registered = patients.registered_as_of("index_date"),
-    ),        
+        prev_elevated_48 OR prepandemic_prediabetes
+        """
+    ),
     prepandemic_hba1c = patients.with_these_clinical_events(
         hba1c_new_codes,
         find_last_match_in_period=True,
@@ -55,7 +47,7 @@ study = StudyDefinition(
             "float": {"distribution": "normal", "mean": 40.0, "stddev": 20},
             "incidence": 0.95,
         },
-    ),  
+    ),
     prev_elevated_48 = patients.satisfying(
             """
             prepandemic_hba1c > 48
@@ -84,6 +76,5 @@ study = StudyDefinition(
         return_expectations={
             "incidence": 0.05,
         }
-    ),  
-    **common_variables
-)
\ No newline at end of file
+    ),
+)
@@ -0,0 +1,167 @@
+import ast
+import os
+import pandas as pd
+
+from expressions import expression_names
+
+# The study definitions import cohortextractor, which is not available to
+# the python actions, so their variables are read from the source instead.
+# Each variable becomes a dict of the patients.* function called and its
+# arguments; codelists are kept as {'codelist': name} and variables nested
+# inside another (e.g. age inside age_group) as specs of their own.
+
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(analysis_dir)
+
+
+def parse_node(node, module_dicts):
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        return {
+            'function': node.func.attr,
+            'args': [parse_node(arg, module_dicts) for arg in node.args],
+            'kwargs': {kw.arg: parse_node(kw.value, module_dicts) for kw in node.keywords},
+        }
+    if isinstance(node, ast.Name):
+        return {'codelist': node.id}
+    if isinstance(node, ast.Dict):
+        return {ast.literal_eval(k): parse_node(v, module_dicts) for k, v in zip(node.keys, node.values)}
+    return ast.literal_eval(node)
+
+
+# Keyword arguments of a call, expanding **name from dicts defined in
+# other analysis modules
+def parse_keywords(call, module_dicts):
+    out = {}
+    for kw in call.keywords:
+        if kw.arg is None:
+            out.update(module_dicts[kw.value.id])
+        else:
+            out[kw.arg] = parse_node(kw.value, module_dicts)
+    return out
+
+
+def parse_module(module_name):
+    with open(os.path.join(analysis_dir, f'{module_name}.py')) as f:
+        tree = ast.parse(f.read())
+
+    # Dicts imported from sibling modules, e.g. common_variables
+    module_dicts = {}
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and os.path.exists(os.path.join(analysis_dir, f'{node.module}.py')):
+            imported = parse_module(node.module)
+            for alias in node.names:
+                if alias.name == '*':
+                    module_dicts.update(imported)
+                elif alias.name in imported:
+                    module_dicts[alias.asname or alias.name] = imported[alias.name]
+
+    assigned = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            func = node.value.func
+            func_name = func.id if isinstance(func, ast.Name) else func.attr
+            if func_name in ('dict', 'StudyDefinition'):
+                assigned[node.targets[0].id] = parse_keywords(node.value, module_dicts)
+    return assigned
+
+
+# Variables of a study definition, e.g. 'all_patients', in declaration order.
+# Study-level settings (default_expectations, index_date) are left out.
+def study_variables(study):
+    study_kwargs = parse_module(f'study_definition_{study}')['study']
+    return {name: spec for name, spec in study_kwargs.items()
+            if isinstance(spec, dict) and 'function' in spec}
+
+
+# Variables nested inside a variable's definition, which cohortextractor
+# evaluates but does not output
+def nested_variables(spec):
+    return {name: value for name, value in spec['kwargs'].items()
+            if isinstance(value, dict) and 'function' in value}
+
+
+# Every variable a study refers to, including those nested inside another
+# variable's definition, which any expression in the study may use
+def all_variables(variables):
+    out = {}
+    for name, spec in variables.items():
+        out[name] = spec
+        out.update(all_variables(nested_variables(spec)))
+    return out
+
+
+# Category ratios from a variable's return_expectations, if declared
+def expected_ratios(spec):
+    return spec['kwargs'].get('return_expectations', {}).get('category', {}).get('ratios')
+
+
+# A study's default_expectations, used for variables that do not declare
+# their own return_expectations
+def study_defaults(study):
+    return parse_module(f'study_definition_{study}')['study'].get('default_expectations', {})
+
+
+# Codes of each codelist defined in codelists.py, read from the same CSVs
+# as codelist_from_csv, as {name: {'codes': [...], 'categories': [...]}}.
+# categories (the category_column, in code order) is None where not given.
+def study_codelists():
+    with open(os.path.join(analysis_dir, 'codelists.py')) as f:
+        tree = ast.parse(f.read())
+
+    codelists = {}
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)):
+            continue
+        func = node.value.func
+        func_name = func.id if isinstance(func, ast.Name) else func.attr
+        args = [parse_node(arg, {}) for arg in node.value.args]
+        kwargs = {kw.arg: parse_node(kw.value, {}) for kw in node.value.keywords}
+        if func_name == 'codelist_from_csv':
+            df = pd.read_csv(os.path.join(repo_dir, args[0]), dtype=str)
+            category_column = kwargs.get('category_column')
+            codelist = {'codes': df[kwargs['column']].tolist(),
+                        'categories': df[category_column].tolist() if category_column else None}
+        elif func_name == 'codelist':
+            codelist = {'codes': [str(code) for code in args[0]], 'categories': None}
+        elif func_name == 'combine_codelists':
+            parts = [codelists[arg['codelist']] for arg in args]
+            codelist = {'codes': [code for part in parts for code in part['codes']], 'categories': None}
+        else:
+            continue
+        codelists[node.targets[0].id] = codelist
+    return codelists
+
+
+# Whether a spec's arguments refer to the index date, directly or through
+# a variable nested inside it
+def refers_to_index_date(value):
+    if isinstance(value, str):
+        return 'index_date' in value
+    if isinstance(value, dict):
+        return any(refers_to_index_date(item) for key, item in value.items() if key != 'return_expectations')
+    if isinstance(value, (list, tuple)):
+        return any(refers_to_index_date(item) for item in value)
+    return False
+
+
+# Variables whose values are the same at every index date: they query no
+# window or date relative to index_date (e.g. on_or_before="2020-03-01",
+# sex) and refer to no variable that does. variables is every variable of
+# the study, as from all_variables.
+def fixed_variables(variables):
+    fixed = {}
+
+    def is_fixed(name):
+        if name not in fixed:
+            spec = variables[name]
+            fixed[name] = False
+            expressions = []
+            if spec['function'] == 'satisfying':
+                expressions = [spec['args'][0]]
+            elif spec['function'] == 'categorised_as':
+                expressions = list(spec['args'][0].values())
+            names = {ref for expression in expressions for ref in expression_names(expression) if ref in variables}
+            fixed[name] = not refers_to_index_date(spec) and all(is_fixed(ref) for ref in names)
+        return fixed[name]
+
+    return [name for name in variables if is_fixed(name)]
@@ -0,0 +1,214 @@
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from aggregate import grouping_sets, latest_per_patient
+from cache import add_cache_argument, cached_call, set_enabled
+from config import hba1c_thresholds
+from instrumentation import stage, write_report
+from io_utils import dataset_dates, dataset_dir, dimension_dir, dimension_patient_ids, partition_path, read_dataset
+from patient_sets import count, intersection, patient_set, union
+from suppression import suppress
+from sketches import bin_end, bin_start, hba1c_bin, histogram_quantiles, merge_histograms
+from thresholds import above, band_col, band_rows
+
+# Aggregations behind notebooks/data_description.ipynb and
+# notebooks/tables.ipynb, computed from the consolidated all_patients
+# dataset and written as small summary_*.csv files that the notebooks only
+# render, so executing them never reads the cohort itself. The HbA1c
+# sketch cells, counts per month, segment and 1 mmol/mol bin, are an
+# intermediate kept as hba1c_sketches.csv (highly sensitive); only the
+# histograms and quantiles merged from them are released, after small
+# number suppression.
+
+summary_dir = 'output/data'
+
+# Demographics tabulated for T2DM patients, with their table headings
+table_demographics = {'age_group': 'Age Group', 'sex': 'Sex', 'ethnicity': 'Ethnicity',
+                      'region': 'Region', 'imd': 'IMD', 'learning_disability': 'Learning Disability',
+                      'mental_illness': 'Mental Illness'}
+
+import_vars = ['patient_key', 'took_hba1c', 'diabetes_type', 'hba1c_mmol_per_mol', band_col] + list(table_demographics)
+
+# Recode variables
+lookup_dict = {
+    'ethnicity': {1: 'White', 2: 'Mixed', 3: 'Asian', 4: 'Black', 5: 'Other', 0: 'Unknown'},
+    'imd': {0: 'Unknown', 1: '1 Most deprived', 2: '2', 3: '3', 4: '4', 5: '5 Least deprived'},
+    'learning_disability': {1: 'Yes', 0: 'No'},
+    'diabetes_type': {'NO_DM': 'No Diabetes', 'T1DM': 'Type 1 Diabetes',
+                      'T2DM': 'Type 2 Diabetes', 'UNKNOWN_DM': 'Unknown Diabetes'},
+}
+
+# Category T2DM patients with a missing value are tabulated under, so every
+# characteristic counts the same patients: those without an ethnicity row
+# as Unknown, as the tables notebook did, and those without a mental
+# illness category (its DEFAULT, read as missing) as None
+table_missing = {'ethnicity': 0, 'mental_illness': 'None'}
+
+# Quantiles reported for each HbA1c distribution
+quantiles = {'q1': 0.25, 'median': 0.5, 'q3': 0.75}
+
+
+# One month's patient sets, keyed by (statistic, cohort), and its count of
+# tests with a 0 or missing value. Each patient has one row a month, so
+# sets of patients matching several conditions in the same row are the
+# intersections of the sets for each condition. Patients above each HbA1c
+# threshold are the union of those in the bands above it.
+def description_month(df_month):
+    ids = df_month.patient_key.to_numpy()
+    hba1c = df_month.hba1c_mmol_per_mol.to_numpy(dtype=np.float64)
+    tested = df_month.took_hba1c.to_numpy() == 1
+    masks = {'Total': np.ones(len(df_month), dtype=bool),
+             'T1DM': (df_month.diabetes_type == 'T1DM').to_numpy(),
+             'T2DM': (df_month.diabetes_type == 'T2DM').to_numpy()}
+    base = {cohort: patient_set(ids[mask]) for cohort, mask in masks.items()}
+    base['tested'] = patient_set(ids[tested])
+    bands = [patient_set(ids[rows]) for rows in band_rows(df_month[band_col].to_numpy())]
+    base.update(above(bands, union))
+
+    sets = {('population', cohort): base[cohort] for cohort in masks}
+    sets.update({('tested', cohort): intersection(base[cohort], base['tested']) for cohort in masks})
+    sets.update({('tested', f'T2DM & HbA1c > {limit}'): intersection(base['T2DM'], base['tested'], base[limit])
+                 for limit in hba1c_thresholds})
+    invalid = tested & ((hba1c == 0) | np.isnan(hba1c))
+    invalid_counts = {('invalid_tests', cohort): int((mask & invalid).sum()) for cohort, mask in masks.items()}
+    return sets, invalid_counts
+
+
+# Patient counts and test counts over all months (data_description.ipynb),
+# from the monthly sets of description_month: a patient is counted once
+# however many months they appear in
+def description_counts(months):
+    sets, invalid_counts = {}, {}
+    for month_sets, month_invalid in months:
+        for key, patients in month_sets.items():
+            sets[key] = union(sets[key], patients) if key in sets else patients
+        for key, n in month_invalid.items():
+            invalid_counts[key] = invalid_counts.get(key, 0) + n
+    rows = [(*key, count(patients)) for key, patients in sets.items()]
+    rows += [(*key, n) for key, n in invalid_counts.items()]
+    return pd.DataFrame(rows, columns=['statistic', 'cohort', 'value'])
+
+
+# Fixed-bin HbA1c histogram cells of one month, one set per diabetes type
+# and demographic category (grouping '' for all patients), as rows of
+# date, diabetes_type, grouping, category, hba1c_bin and count
+def sketch_month(df_month):
+    df_month = df_month.assign(hba1c_bin=hba1c_bin(df_month.hba1c_mmol_per_mol))
+    cells = grouping_sets(df_month, ['date', 'diabetes_type', 'hba1c_bin'],
+                          [None] + list(table_demographics), {'count': None})
+    frames = []
+    for group, df in cells.items():
+        category = df.pop(group).astype(str) if group else ''
+        frames.append(df.assign(grouping=group or '', category=category))
+    return pd.concat(frames, ignore_index=True)
+
+
+# HbA1c distributions of all patients and of T2DM patients above each
+# threshold (data_description.ipynb), with their median and IQR, merged
+# from the sketch cells. Bins with small counts are suppressed, as are the
+# quantiles of a series with a small total.
+def description_histograms(sketch):
+    overall = sketch.loc[sketch.grouping == '']
+    t2dm = overall.loc[overall.diabetes_type == 'T2DM']
+    series = {'All Patients': merge_histograms(overall)}
+    series.update({f'Patients with T2DM & HbA1c > {limit}': merge_histograms(t2dm.loc[t2dm.hba1c_bin > limit])
+                   for limit in hba1c_thresholds})
+
+    hists = pd.concat([pd.DataFrame({'series': name, 'bin_start': bin_start(hist.index),
+                                     'bin_end': bin_end(hist.index), 'count': hist.to_numpy()})
+                       for name, hist in series.items()], ignore_index=True)
+    stats = pd.DataFrame([{'series': name, **dict(zip(quantiles, histogram_quantiles(hist, quantiles.values()))),
+                           'count': int(hist[hist.index > 0].sum())}
+                          for name, hist in series.items()])
+    hists = suppress(hists, ['count'], by='series', action='mask').astype({'count': 'Int64'})
+    stats = suppress(stats, ['count'], action='mask').astype({'count': 'Int64'})
+    stats.loc[stats['count'].isna(), list(quantiles)] = np.nan
+    return hists, stats
+
+
+# Missing values of a column replaced with value
+def fill_missing(series, value):
+    if series.dtype.name == 'category' and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+# Population and patients tested by a variable, labelled for display and in
+# label order
+def counts_by(df_in, var):
+    df_out = grouping_sets(df_in, [], [var], {'population': None, 'took_hba1c': 'took_hba1c'})[var]
+    df_out = df_out.rename(columns={var: 'category'})
+    if var in lookup_dict:
+        df_out['category'] = df_out['category'].map(lambda value: lookup_dict[var].get(value, value))
+    df_out['category'] = df_out['category'].astype(str)
+    return df_out.sort_values('category', kind='stable').reset_index(drop=True)
+
+
+# Counts by diabetes status and by demographic for T2DM patients, each
+# patient counted once with their latest record (tables.ipynb). frames are
+# the monthly extracts in date order.
+def table_summaries(frames, n_patients):
+    df_latest = latest_per_patient((df.drop(columns=['date']) for df in frames), n_patients)
+    by_dm = counts_by(df_latest, 'diabetes_type')
+
+    df_t2dm = df_latest.loc[df_latest.diabetes_type == 'T2DM']
+    df_t2dm = df_t2dm.assign(**{var: fill_missing(df_t2dm[var], value) for var, value in table_missing.items()})
+    by_demo = pd.concat([counts_by(df_t2dm, var).assign(characteristic=heading)
+                         for var, heading in table_demographics.items()], ignore_index=True)
+    return by_dm, by_demo[['characteristic', 'category', 'population', 'took_hba1c']]
+
+
+# Summaries written for the server only, not released
+intermediates = ['hba1c_sketches']
+
+
+def summary_path(name):
+    return os.path.join(summary_dir, f'{name}.csv' if name in intermediates else f'summary_{name}.csv')
+
+
+# Both sets of summaries from one read of the dataset, a month at a time
+def all_summaries():
+    description_months = []
+    sketch_months = []
+
+    def months():
+        for date in dataset_dates('all_patients'):
+            label = f'{date:%Y-%m-%d}'
+            with stage('read_month', [os.path.dirname(partition_path('all_patients', date))], date=label) as metrics:
+                df_month = read_dataset('all_patients', import_vars, date, date)
+                metrics['rows_out'] = len(df_month)
+            with stage('patient_sets', date=label) as metrics:
+                metrics['rows_in'] = len(df_month)
+                description_months.append(description_month(df_month))
+            with stage('sketches', date=label) as metrics:
+                metrics['rows_in'] = len(df_month)
+                sketch_months.append(sketch_month(df_month))
+                metrics['rows_out'] = len(sketch_months[-1])
+            yield df_month
+
+    with stage('table_summaries'):
+        by_dm, by_demo = table_summaries(months(), len(dimension_patient_ids('all_patients')))
+
+    with stage('description_summaries'):
+        counts = description_counts(description_months)
+        sketch = pd.concat(sketch_months, ignore_index=True)
+        hists, stats = description_histograms(sketch)
+
+    return {'description_counts': counts, 'hba1c_histograms': hists, 'hba1c_quantiles': stats,
+            'hba1c_sketches': sketch, 'tables_by_dm': by_dm, 'tables_t2dm_by_demographic': by_demo}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_cache_argument(parser)
+    set_enabled(parser.parse_args().cache)
+
+    # Reruns against unchanged partitions are served from the cache
+    summaries = cached_call(all_summaries, [dataset_dir('all_patients'), dimension_dir('all_patients')])
+    for name, df in summaries.items():
+        with stage('write', outputs=[summary_path(name)], summary=name):
+            df.to_csv(summary_path(name), index=False)
+
+    write_report('generate_summaries')
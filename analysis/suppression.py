@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from config import suppression
+
+
+# Small number suppression for measure and summary tables, applied to all
+# count columns in one vectorised pass.
+#
+# Counts at or below threshold are suppressed. With secondary=True, any
+# group of rows (e.g. one date) with exactly one suppressed cell in a column
+# also has its next smallest cell suppressed, so the hidden value cannot be
+# recovered from the total. With rounding set, remaining counts are rounded
+# to the nearest multiple. action='drop' removes rows with any suppressed
+# count; action='mask' replaces suppressed cells with NaN.
+def suppress(df, counts, by=None, action='drop', threshold=suppression['threshold'],
+             secondary=suppression['secondary'], rounding=suppression['rounding']):
+    values = df[counts].to_numpy(dtype=np.float64)
+    mask = values <= threshold
+
+    if secondary and by is not None:
+        n_suppressed = pd.DataFrame(mask, index=df.index).groupby(df[by]).transform('sum').to_numpy()
+        remaining = pd.DataFrame(np.where(mask, np.inf, values), index=df.index)
+        group_min = remaining.groupby(df[by]).transform('min').to_numpy()
+        mask |= (n_suppressed == 1) & (values == group_min)
+
+    if rounding:
+        # Missing counts stay missing, as nullable integers
+        rounded = pd.DataFrame(np.round(values / rounding) * rounding, index=df.index, columns=counts)
+        df = df.copy()
+        df[counts] = rounded.astype('Int64' if np.isnan(values).any() else np.int64)
+
+    if action == 'drop':
+        return df.loc[~mask.any(axis=1)]
+    df = df.copy()
+    df[counts] = df[counts].mask(mask)
+    return df
@@ -0,0 +1,265 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import start_date, end_date
+from expressions import StudyColumns, variable_window
+from io_utils import plain_strings, write_cohort_chunks
+from study_variables import all_variables, expected_ratios, study_codelists, study_defaults, study_variables
+
+# Synthetic cohort extracts for local runs and benchmarking, sampled from
+# the return_expectations declared in the study definitions (falling back
+# to each study's default_expectations). Values are drawn in NumPy batches,
+# so extracts far larger than cohortextractor's dummy data can be made.
+#
+# Only variables that query the record are sampled. categorised_as and
+# satisfying variables are evaluated from them, so e.g. prev_hba1c_gt_75
+# always agrees with prev_hba1c_mmol_per_mol, and variables querying the
+# same codelist over the same period (took_hba1c, hba1c_mmol_per_mol)
+# share one draw of whether the patient has a match. As with
+# cohortextractor's dummy data, the population expression is not applied.
+#
+# To fill output/data for a local run of the python actions:
+#
+#   python analysis/synthetic_data.py --rows 1000000 --format feather
+
+date_returning = ['date']
+count_returning = ['number_of_matches_in_period']
+value_returning = ['numeric_value']
+# Recorded for every registered patient, whatever the default incidence
+universal_functions = ['age_as_of', 'address_as_of', 'registered_as_of']
+
+
+def expectations(spec, defaults):
+    declared = spec['kwargs'].get('return_expectations', {})
+    # A declared universal rate overrides the default incidence
+    if spec['function'] in universal_functions or declared.get('rate') == 'universal':
+        defaults = {key: value for key, value in defaults.items() if key != 'incidence'}
+        defaults['rate'] = 'universal'
+    return {**defaults, **declared}
+
+
+# Share of patients with a value. "universal" variables always have one.
+def incidence(expected):
+    if expected.get('rate') == 'universal' and 'incidence' not in expected:
+        return 1.0
+    return expected.get('incidence', 1.0)
+
+
+# String values as a categorical with '' for patients without a value.
+# Categoricals are built from integer codes, so no strings are formatted
+# or compared per row.
+def with_missing(codes, labels, present):
+    return pd.Categorical.from_codes(np.where(present, codes + 1, 0), [''] + list(labels))
+
+
+# Dates uniform over the variable's period, limited to the expected date
+# range where the period is open
+def sample_dates(present, expected, rng, window=(None, None), include_day=True):
+    date_range = expected.get('date', {})
+    earliest = pd.Timestamp(date_range.get('earliest', '1900-01-01'))
+    latest = date_range.get('latest', 'today')
+    latest = pd.Timestamp.today().normalize() if latest == 'today' else pd.Timestamp(latest)
+    start, end = window
+    earliest = earliest if start is None else start
+    latest = max(earliest, latest if end is None else end)
+    days = np.arange(np.datetime64(earliest.date(), 'D'), np.datetime64(latest.date(), 'D') + 1)
+    codes = rng.integers(0, len(days), len(present))
+    if include_day:
+        return with_missing(codes, days.astype(str), present)
+    months = days.astype('datetime64[M]')
+    return with_missing((months - months[0]).astype(np.int64)[codes], np.unique(months).astype(str), present)
+
+
+def sample_categories(present, ratios, rng):
+    keys = list(ratios)
+    p = np.array(list(ratios.values()), dtype=np.float64)
+    codes = rng.choice(len(keys), len(present), p=p / p.sum())
+    if all(str(k).isdigit() for k in keys):
+        return np.where(present, np.array(keys, dtype=np.int64)[codes], 0)
+    return with_missing(codes, keys, present)
+
+
+# Variables querying the same codelist over the same period match the same
+# patients
+def match_key(spec):
+    kwargs = spec['kwargs']
+    codelist = spec['args'][0].get('codelist') if spec['args'] and isinstance(spec['args'][0], dict) else None
+    if codelist is None:
+        return None
+    return (spec['function'], codelist, repr(kwargs.get('between')),
+            kwargs.get('on_or_after'), kwargs.get('on_or_before'))
+
+
+# One column of synthetic values for a variable that queries the record.
+# present is whether each patient has a value.
+def sample_variable(spec, present, rng, defaults, index_date):
+    n = len(present)
+    kwargs = spec['kwargs']
+    expected = expectations(spec, defaults)
+    ratios = expected_ratios(spec)
+    returning = kwargs.get('returning', 'binary_flag')
+
+    if ratios is not None:
+        return sample_categories(present, ratios, rng)
+    if 'float' in expected:
+        dist = expected['float']
+        return np.where(present, rng.normal(dist.get('mean', 0), dist.get('stddev', 1), n).round(1), 0.0)
+    if returning in date_returning or kwargs.get('return_last_date_in_period') or kwargs.get('return_first_date_in_period'):
+        include_day = not kwargs.get('include_month') or kwargs.get('include_day')
+        return sample_dates(present, expected, rng, variable_window(kwargs, index_date), include_day)
+    if returning in count_returning:
+        return np.where(present, rng.poisson(2, n) + 1, 0)
+    if spec['function'] == 'age_as_of':
+        return rng.integers(0, 105, n)
+    if returning == 'index_of_multiple_deprivation':
+        rounding = kwargs.get('round_to_nearest', 1)
+        return np.where(present, (rng.integers(0, 32845, n) / rounding).round() * rounding, 0).astype(np.int64)
+    return present.astype(np.int64)
+
+
+# Columns of one synthetic cohort, sampling the variables that query the
+# record
+class SyntheticColumns(StudyColumns):
+    def __init__(self, specs, defaults, n, rng, index_date):
+        super().__init__(specs, n)
+        self.defaults, self.rng, self.index_date = defaults, rng, index_date
+        self.matches = {}
+
+    def query(self, name, spec):
+        n = self.n
+        expected = expectations(spec, self.defaults)
+        key = match_key(spec)
+        if key is None or key not in self.matches:
+            self.matches[key] = self.rng.random(n) < incidence(expected)
+        present = self.matches[key]
+        values = sample_variable(spec, present, self.rng, self.defaults, self.index_date)
+        if spec['kwargs'].get('include_date_of_match'):
+            window = variable_window(spec['kwargs'], self.index_date)
+            self[f'{name}_date_measured'] = sample_dates(present, expected, self.rng, window)
+        return values
+
+
+# Sample a cohort for one index date as a frame, given its patient ids
+def synthetic_chunk(variables, defaults, patient_ids, rng, index_date=end_date):
+    columns = SyntheticColumns(all_variables(variables), defaults, len(patient_ids), rng, index_date)
+    df = pd.DataFrame({'patient_id': patient_ids})
+    for name in variables:
+        if name == 'population':
+            continue
+        df[name] = plain_strings(columns[name])
+        if f'{name}_date_measured' in columns:
+            df[f'{name}_date_measured'] = plain_strings(columns[f'{name}_date_measured'])
+    return df
+
+
+# Patients in a month's extract: each of the n_patients registered patients
+# is included with probability share, so ids stay sorted and largely
+# overlap from one month to the next, as in the real extracts
+def monthly_patient_ids(n_patients, share, rng):
+    return np.flatnonzero(rng.random(n_patients) < share).astype(np.int64) + 1
+
+
+# Frames of at most chunk_size rows making up one synthetic extract
+def synthetic_extract(study, patient_ids, rng, index_date=end_date, chunk_size=1000000):
+    variables, defaults = study_variables(study), study_defaults(study)
+    for start in range(0, len(patient_ids), chunk_size):
+        yield synthetic_chunk(variables, defaults, patient_ids[start:start + chunk_size], rng, index_date)
+
+
+# Write the extracts the generate_cohort actions would: all_patients for
+# every month and ethnicity and prepandemic once. Around rows patients are
+# in each all_patients extract and the ethnicity extract covers everyone.
+# prepandemic covers half of them, of whom derive_elev_predm.py keeps those
+# meeting its population condition, around a fifth of all_patients.
+def write_synthetic_extracts(data_dir, rows, months=None, fmt='feather', seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    n_patients = int(rows * 1.25)
+    dates = pd.date_range(start_date, end_date, freq='MS')[:months]
+    write_cohort_chunks(synthetic_extract('ethnicity', np.arange(1, n_patients + 1), rng),
+                        os.path.join(data_dir, f'input_ethnicity.{fmt}'))
+    write_cohort_chunks(synthetic_extract('prepandemic', monthly_patient_ids(n_patients, 0.5, rng), rng),
+                        os.path.join(data_dir, f'input_prepandemic.{fmt}'))
+    for date in dates:
+        patient_ids = monthly_patient_ids(n_patients, 0.8, rng)
+        write_cohort_chunks(synthetic_extract('all_patients', patient_ids, rng, f'{date:%Y-%m-%d}'),
+                            os.path.join(data_dir, f'input_all_patients_{date:%Y-%m-%d}.{fmt}'))
+
+
+# Event-level tables for local_extract.py covering n_patients patients, one
+# parquet file per table. Each codelist a monthly study queries has events
+# for the share of patients its variables expect (their incidence);
+# codelists queried for values, and medications, get several events a year
+# over the study period, with values drawn as the variable expects, others
+# a few events spread over earlier years.
+def write_synthetic_events(events_dir, n_patients, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(events_dir, exist_ok=True)
+    patient_ids = np.arange(1, n_patients + 1)
+    specs, defaults = all_variables(study_variables('all_patients')), study_defaults('all_patients')
+
+    def ratios_sample(name, present):
+        return plain_strings(sample_categories(present, expected_ratios(specs[name]), rng))
+
+    def write(name, df):
+        df.to_parquet(os.path.join(events_dir, f'{name}.parquet'), index=False)
+
+    births = sample_dates(np.ones(n_patients, dtype=bool), {'date': {'earliest': '1910-01-01', 'latest': '2015-12-31'}},
+                          rng, include_day=False)
+    write('patients', pd.DataFrame({'patient_id': patient_ids, 'sex': ratios_sample('sex', np.ones(n_patients, bool)),
+                                    'date_of_birth': plain_strings(births)}))
+
+    ongoing = rng.random(n_patients) < 0.9
+    start = pd.Timestamp('1990-01-01') + pd.to_timedelta(rng.integers(0, 11000, n_patients), unit='D')
+    end = start + pd.to_timedelta(rng.integers(0, 3000, n_patients), unit='D')
+    region = ratios_sample('region', rng.random(n_patients) < incidence(expectations(specs['region'], defaults)))
+    write('registrations', pd.DataFrame({'patient_id': patient_ids, 'start_date': start,
+                                         'end_date': end.where(~ongoing), 'region': region}))
+    write('addresses', pd.DataFrame({'patient_id': patient_ids, 'start_date': pd.Timestamp('1980-01-01'),
+                                     'end_date': pd.NaT, 'index_of_multiple_deprivation': rng.integers(0, 32845, n_patients)}))
+
+    for function, table in [('with_these_clinical_events', 'clinical_events'), ('with_these_medications', 'medications')]:
+        codelists = study_codelists()
+        queried = {}
+        for spec in specs.values():
+            if spec['function'] == function:
+                queried.setdefault(spec['args'][0]['codelist'], []).append(spec)
+        frames = []
+        for codelist, codelist_specs in queried.items():
+            valued = [spec for spec in codelist_specs if spec['kwargs'].get('returning') in value_returning]
+            spec = (valued or codelist_specs)[0]
+            expected = expectations(spec, defaults)
+            valued = bool(valued) or table == 'medications'
+            patients = patient_ids[rng.random(n_patients) < incidence(expected)]
+            counts = rng.poisson(12 if valued else 1, len(patients)) + 1
+            event_patients = np.repeat(patients, counts)
+            earliest = '2018-01-01' if valued else '2000-01-01'
+            dates = sample_dates(np.ones(len(event_patients), bool),
+                                 {'date': {'earliest': earliest, 'latest': end_date}}, rng)
+            codes = np.array(codelists[codelist]['codes'], dtype=object)
+            df = pd.DataFrame({'patient_id': event_patients, 'date': plain_strings(dates),
+                               'code': codes[rng.integers(0, len(codes), len(event_patients))]})
+            if table == 'clinical_events':
+                dist = expected.get('float', {'mean': 0, 'stddev': 0})
+                df['numeric_value'] = rng.normal(dist.get('mean', 0), dist.get('stddev', 1), len(df)).round(1)
+            frames.append(df)
+        write(table, pd.concat(frames, ignore_index=True).sort_values(['patient_id', 'date'], kind='stable'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000, help='patients per monthly all_patients extract')
+    parser.add_argument('--months', type=int, help='only the first MONTHS index dates')
+    parser.add_argument('--format', default='feather', choices=['feather', 'parquet', 'csv.gz', 'csv'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default='output/data')
+    parser.add_argument('--events-dir', help='write event-level tables for local_extract.py here instead')
+    args = parser.parse_args()
+
+    if args.events_dir:
+        write_synthetic_events(args.events_dir, int(args.rows * 1.25), args.seed)
+    else:
+        write_synthetic_extracts(args.output_dir, args.rows, args.months, args.format, args.seed)
@@ -0,0 +1,63 @@
+import numpy as np
+import operator
+
+from config import hba1c_thresholds
+
+# HbA1c thresholds held as a single band column rather than a 0/1 column
+# per threshold. Band k (1..n) holds values above the k-th threshold and at
+# or below the next, band 0 values at or below the first threshold and
+# patients without a value. Counts above any threshold are the sums of the
+# bands above it, so adding a threshold to config.hba1c_thresholds adds a
+# band, not a column or another pass over the data.
+
+band_col = 'hba1c_band'
+
+
+def threshold_column(limit, prefix=''):
+    return f'{prefix}hba1c_gt_{limit}'
+
+
+# Band of each value, found by binary search of the thresholds
+def hba1c_band(values, cuts=hba1c_thresholds):
+    values = np.asarray(values, dtype=np.float64)
+    bands = np.searchsorted(np.asarray(cuts, dtype=np.float64), values, side='left')
+    return np.where(np.isnan(values), 0, bands).astype(np.int8)
+
+
+# Add the band column to an extract that has HbA1c values
+def add_band(df):
+    if 'hba1c_mmol_per_mol' in df.columns:
+        df[band_col] = hba1c_band(df['hba1c_mmol_per_mol'])
+    return df
+
+
+# Row positions in each band, in row order, from one sort of the band column
+def band_rows(bands, cuts=hba1c_thresholds):
+    bands = np.asarray(bands, dtype=np.int64)
+    order = np.argsort(bands, kind='stable')
+    bounds = np.cumsum(np.bincount(bands, minlength=len(cuts) + 1))
+    return np.split(order, bounds[:-1])
+
+
+# Totals above each threshold, keyed by threshold, from totals per band
+# (indexed by band), accumulated from the top band down with combine, e.g.
+# operator.add for counts or patient_sets.union for sets of patients
+def above(per_band, combine=operator.add, cuts=hba1c_thresholds):
+    totals = {}
+    total = None
+    for band in range(len(cuts), 0, -1):
+        total = per_band[band] if total is None else combine(total, per_band[band])
+        totals[cuts[band - 1]] = total
+    return {limit: totals[limit] for limit in cuts}
+
+
+# Collapse grouping_sets output keyed on the band as well as keys into one
+# row per key: every sum over all bands, plus count_col above each
+# threshold as a threshold_column(limit, prefix) column
+def band_sums(df, keys, count_col, prefix='', cuts=hba1c_thresholds):
+    sums = df.drop(columns=[band_col]).groupby(keys, sort=True).sum()
+    by_band = df.pivot_table(index=keys, columns=band_col, values=count_col, aggfunc='sum', fill_value=0)
+    per_band = [by_band[band] if band in by_band.columns else 0 for band in range(len(cuts) + 1)]
+    for limit, total in above(per_band, cuts=cuts).items():
+        sums[threshold_column(limit, prefix)] = total
+    return sums.reset_index()
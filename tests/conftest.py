@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The analysis scripts import each other by module name, as they do when
+# run as python analysis/<script>.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analysis'))
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregate import grouping_columns, grouping_sets, latest_per_patient, merge_grouping_sets
+
+
+@pytest.fixture
+def cohort():
+    rng = np.random.default_rng(0)
+    n = 2000
+    return pd.DataFrame({
+        'date': rng.choice(['2021-01-01', '2021-02-01'], n),
+        'sex': pd.Categorical(rng.choice(['F', 'M', None], n, p=[0.5, 0.45, 0.05])),
+        'age_group': rng.choice(['18-39', '40-64', '65+'], n),
+        'region': rng.choice(['East', 'London', None], n, p=[0.5, 0.4, 0.1]),
+        'took_hba1c': rng.integers(0, 2, n),
+        'hba1c_gt_48': rng.integers(0, 2, n).astype(float),
+    })
+
+
+groupings = [None, 'sex', 'region', ('sex', 'age_group')]
+sums = {'population': None, 'took_hba1c': 'took_hba1c', 'hba1c_gt_48': 'hba1c_gt_48'}
+
+
+def expected(df, group):
+    keys = grouping_columns('date', group)
+    out = df.assign(population=1).groupby(keys, sort=True, observed=True)[list(sums)].sum().reset_index()
+    return out.astype({col: np.int64 for col in sums})
+
+
+@pytest.mark.parametrize('group', groupings)
+def test_grouping_sets_matches_groupby(cohort, group):
+    result = grouping_sets(cohort, 'date', groupings, sums)[group]
+    want = expected(cohort, group)
+    keys = grouping_columns('date', group)
+    pd.testing.assert_frame_equal(result.astype({col: object for col in keys}).reset_index(drop=True),
+                                  want.astype({col: object for col in keys}), check_dtype=False)
+
+
+def test_merge_grouping_sets_matches_whole_cohort(cohort):
+    parts = [grouping_sets(df, 'date', groupings, sums) for _, df in cohort.groupby('date')]
+    merged = merge_grouping_sets(parts, 'date')
+    for group in groupings:
+        keys = grouping_columns('date', group)
+        pd.testing.assert_frame_equal(merged[group].astype({col: object for col in keys}),
+                                      expected(cohort, group).astype({col: object for col in keys}),
+                                      check_dtype=False)
+
+
+def test_merge_grouping_sets_without_partitions():
+    merged = merge_grouping_sets([], 'date', groupings, list(sums))
+    assert list(merged) == groupings
+    assert list(merged[('sex', 'age_group')].columns) == ['date', 'sex', 'age_group'] + list(sums)
+    assert all(df.empty for df in merged.values())
+
+
+def months(n_patients=300, n_months=4):
+    rng = np.random.default_rng(4)
+    frames = []
+    for i in range(n_months):
+        keys = rng.choice(n_patients, rng.integers(50, n_patients), replace=False)
+        frames.append(pd.DataFrame({
+            'patient_key': keys,
+            # Each month's categoricals hold only the categories seen in it
+            'region': pd.Categorical(rng.choice(['East', 'London', f'Region {i}'], len(keys))),
+            'hba1c_mmol_per_mol': np.where(rng.random(len(keys)) < 0.3, np.nan, rng.normal(45, 10, len(keys))),
+            'took_hba1c': rng.integers(0, 2, len(keys)),
+        }))
+    return frames
+
+
+def test_latest_per_patient_matches_drop_duplicates():
+    frames = months()
+    want = pd.concat(frames, ignore_index=True).drop_duplicates('patient_key', keep='last') \
+        .sort_values('patient_key').reset_index(drop=True)
+    result = latest_per_patient(frames, 300)
+    assert result['patient_key'].tolist() == want['patient_key'].tolist()
+    assert result['region'].astype(str).tolist() == want['region'].astype(str).tolist()
+    np.testing.assert_array_equal(result['hba1c_mmol_per_mol'], want['hba1c_mmol_per_mol'])
+    np.testing.assert_array_equal(result['took_hba1c'], want['took_hba1c'])
+
+
+def test_latest_per_patient_reports_changed_columns():
+    frame = pd.DataFrame({'patient_key': [0, 1], 'sex': pd.Categorical(['F', 'M']), 'value': [1.0, np.nan]})
+    changed = {}
+    latest_per_patient([frame, frame.assign(value=[1.0, np.nan])], 2, changed)
+    assert not any(changed.values())
+    latest_per_patient([frame, frame.assign(sex=pd.Categorical(['F', 'F']))], 2, changed)
+    assert changed['sex'] and not changed['value']
+
+
+def test_latest_per_patient_keeps_unseen_patients_when_asked():
+    frame = pd.DataFrame({'patient_key': [2], 'sex': pd.Categorical(['M']), 'value': [3]})
+    result = latest_per_patient([frame], 4, observed_only=False)
+    assert result['patient_key'].tolist() == [0, 1, 2, 3]
+    assert result['sex'].isna().tolist() == [True, True, False, True]
+    assert result['value'].tolist() == [0, 0, 3, 0]
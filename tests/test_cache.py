@@ -0,0 +1,91 @@
+import importlib
+import os
+import stat
+import sys
+
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def stage_dir(tmp_path, monkeypatch):
+    # A stage module in its own analysis directory, importing a helper
+    # module, with the cache kept under tmp_path
+    code_dir = tmp_path / 'analysis'
+    code_dir.mkdir()
+    (code_dir / 'helper.py').write_text('scale = 2\n')
+    (code_dir / 'stage_module.py').write_text(
+        'from helper import scale\n'
+        'calls = []\n'
+        '\n'
+        'def total(path):\n'
+        '    calls.append(path)\n'
+        '    with open(path) as f:\n'
+        '        return sum(map(int, f.read().split())) * scale\n')
+    monkeypatch.syspath_prepend(str(code_dir))
+    monkeypatch.setattr(cache, 'analysis_dir', str(code_dir))
+    monkeypatch.setitem(cache.cache, 'dir', str(tmp_path / 'cache'))
+    monkeypatch.setitem(cache.cache, 'enabled', True)
+    for name in ('helper', 'stage_module'):
+        sys.modules.pop(name, None)
+    yield code_dir
+    for name in ('helper', 'stage_module'):
+        sys.modules.pop(name, None)
+
+
+def test_unchanged_inputs_and_code_hit(stage_dir, tmp_path):
+    stage_module = importlib.import_module('stage_module')
+    input_path = tmp_path / 'input.txt'
+    input_path.write_text('1 2 3')
+    assert cache.cached_call(stage_module.total, [str(input_path)], str(input_path)) == 12
+    assert cache.cached_call(stage_module.total, [str(input_path)], str(input_path)) == 12
+    assert len(stage_module.calls) == 1
+
+
+def test_changed_input_misses(stage_dir, tmp_path):
+    stage_module = importlib.import_module('stage_module')
+    input_path = tmp_path / 'input.txt'
+    input_path.write_text('1 2 3')
+    cache.cached_call(stage_module.total, [str(input_path)], str(input_path))
+    input_path.write_text('1 2 3 4')
+    assert cache.cached_call(stage_module.total, [str(input_path)], str(input_path)) == 20
+    assert len(stage_module.calls) == 2
+
+
+@pytest.mark.parametrize('module', ['stage_module.py', 'helper.py'])
+def test_changed_code_misses(stage_dir, tmp_path, module):
+    stage_module = importlib.import_module('stage_module')
+    input_path = tmp_path / 'input.txt'
+    input_path.write_text('1 2 3')
+    cache.cached_call(stage_module.total, [str(input_path)], str(input_path))
+    with open(stage_dir / module, 'a') as f:
+        f.write('# changed\n')
+    cache.cached_call(stage_module.total, [str(input_path)], str(input_path))
+    assert len(stage_module.calls) == 2
+
+
+def test_disabled_cache_always_runs(stage_dir, tmp_path, monkeypatch):
+    stage_module = importlib.import_module('stage_module')
+    monkeypatch.setitem(cache.cache, 'enabled', False)
+    input_path = tmp_path / 'input.txt'
+    input_path.write_text('1 2 3')
+    cache.cached_call(stage_module.total, [str(input_path)], str(input_path))
+    cache.cached_call(stage_module.total, [str(input_path)], str(input_path))
+    assert len(stage_module.calls) == 2
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_entries_follow_umask(stage_dir, tmp_path):
+    stage_module = importlib.import_module('stage_module')
+    input_path = tmp_path / 'input.txt'
+    input_path.write_text('1 2 3')
+    old = os.umask(0o022)
+    try:
+        cache.cached_call(stage_module.total, [str(input_path)], str(input_path))
+    finally:
+        os.umask(old)
+    key = cache.cache_key(stage_module.total, [str(input_path)], (str(input_path),))
+    path = cache.entry_dir(key)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o755
+    assert stat.S_IMODE(os.stat(os.path.join(path, 'result.pickle')).st_mode) == 0o644
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from derive_elev_predm import derive_partition, prepandemic_patients
+from io_utils import partition_path, write_cohort_chunks
+
+
+def prepandemic_extract(tmp_path):
+    rng = np.random.default_rng(7)
+    n = 500
+    hba1c = rng.normal(45, 15, n).round(1)
+    df = pd.DataFrame({
+        'patient_id': rng.choice(np.arange(1000, 2000), n, replace=False),
+        'prepandemic_hba1c': hba1c,
+        'prev_elevated_48': (hba1c > 48).astype(int),
+        'prev_elevated_58': (hba1c > 58).astype(int),
+        'prev_elevated_64': (hba1c > 64).astype(int),
+        'prev_elevated_75': (hba1c > 75).astype(int),
+        'prepandemic_prediabetes': (rng.random(n) < 0.1).astype(int),
+    })
+    file_path = tmp_path / 'input_prepandemic.csv'
+    df.to_csv(file_path, index=False)
+    return str(file_path), df
+
+
+def test_population_filter_matches_study_definition(tmp_path):
+    file_path, df = prepandemic_extract(tmp_path)
+    # Keys for the extract's patients plus some all_patients has but the
+    # prepandemic extract does not
+    keys = np.concatenate([df['patient_id'].to_numpy()[::-1], [1, 2, 3]])
+    in_cohort, df_keys = prepandemic_patients(file_path, keys)
+
+    wanted = df.loc[(df.prev_elevated_48 == 1) | (df.prepandemic_prediabetes == 1), 'patient_id']
+    assert sorted(keys[in_cohort].tolist()) == sorted(wanted.tolist())
+    assert df_keys['patient_key'].tolist() == list(range(len(keys)))
+    hba1c = df.set_index('patient_id')['prepandemic_hba1c']
+    np.testing.assert_allclose(df_keys['prepandemic_hba1c'].to_numpy()[:-3], hba1c.loc[keys[:-3]].to_numpy())
+    assert (df_keys['prepandemic_hba1c'].to_numpy()[-3:] == 0).all()
+
+
+def test_partition_keeps_only_the_cohort(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    date = pd.Timestamp('2021-01-01')
+    in_path = partition_path('all_patients', date)
+    os.makedirs(os.path.dirname(in_path))
+    month = pd.DataFrame({'patient_key': np.array([4, 0, 2, 3, 1], dtype=np.int32), 'took_hba1c': [1, 0, 1, 1, 0]})
+    write_cohort_chunks([month], in_path)
+    in_cohort = np.array([False, True, True, False, True])
+    derive_partition(date, in_cohort)
+    out = pq.read_table(partition_path('elev_predm', date)).to_pandas()
+    assert out['patient_key'].tolist() == [4, 2, 1]
+    assert out['took_hba1c'].tolist() == [1, 1, 0]
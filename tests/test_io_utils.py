@@ -0,0 +1,68 @@
+import os
+import stat
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from io_utils import (attach_dimension, dimension_columns, dimension_dir, partition_path, read_cohort, read_dataset,
+                      umask_mode, write_cohort_chunks, write_dimension, write_json)
+
+
+@pytest.fixture
+def umask_022():
+    old = os.umask(0o022)
+    yield
+    os.umask(old)
+
+
+def test_atomic_writes_follow_umask(tmp_path, umask_022):
+    file_path = tmp_path / 'report.json'
+    write_json(str(file_path), {'a': 1})
+    assert stat.S_IMODE(os.stat(file_path).st_mode) == 0o644
+    assert umask_mode(0o777) == 0o755
+
+
+@pytest.mark.parametrize('ext', ['csv', 'feather', 'parquet'])
+def test_none_category_reads_as_missing_in_every_format(tmp_path, ext):
+    df = pd.DataFrame({'patient_id': [1, 2, 3], 'mental_illness': ['None', 'Depression', 'Severe Mental Illness']})
+    file_path = str(tmp_path / f'input_all_patients_2021-01-01.{ext}')
+    getattr(df, f'to_{ext}')(file_path, **({'index': False} if ext == 'csv' else {}))
+    values = read_cohort(file_path)['mental_illness']
+    assert values.isna().tolist() == [True, False, False]
+    assert 'None' not in values.cat.categories
+
+
+def test_dimension_round_trip(tmp_path, umask_022):
+    df = pd.DataFrame({
+        'patient_key': np.arange(4, dtype=np.int32),
+        'patient_id': np.array([40, 10, 30, 20], dtype=np.int64),
+        'sex': ['F', 'M', None, 'F'],
+        'region': pd.Categorical(['London', 'East', 'London', None]),
+        'imd': np.array([1, 5, 0, 3], dtype=np.int8),
+    })
+    write_dimension(df, 'all_patients', str(tmp_path))
+    assert stat.S_IMODE(os.stat(dimension_dir('all_patients', str(tmp_path))).st_mode) == 0o755
+    assert set(dimension_columns('all_patients', str(tmp_path))) == {'patient_id', 'sex', 'region', 'imd'}
+
+    # Rows of any month, in any order, get their patients' attributes
+    rows = pd.DataFrame({'patient_key': [3, 0, 0, 2]})
+    rows = attach_dimension(rows, 'all_patients', ['patient_id', 'sex', 'region', 'imd'], str(tmp_path))
+    assert rows['patient_id'].tolist() == [20, 40, 40, 30]
+    assert rows['sex'].tolist()[:3] == ['F', 'F', 'F'] and pd.isna(rows['sex'].iloc[3])
+    assert rows['region'].tolist()[1:] == ['London', 'London', 'London'] and pd.isna(rows['region'].iloc[0])
+    assert rows['imd'].tolist() == [3, 1, 1, 0]
+    assert rows['imd'].dtype == np.int8
+
+
+def test_read_dataset_attaches_dimension_columns(tmp_path):
+    write_dimension(pd.DataFrame({'patient_key': np.arange(3, dtype=np.int32), 'sex': ['F', 'M', 'F']}),
+                    'all_patients', str(tmp_path))
+    for date, keys in [('2021-01-01', [0, 2]), ('2021-02-01', [2, 1, 0])]:
+        file_path = partition_path('all_patients', date, str(tmp_path))
+        os.makedirs(os.path.dirname(file_path))
+        month = pd.DataFrame({'patient_key': np.array(keys, dtype=np.int32), 'took_hba1c': 1})
+        write_cohort_chunks([month], file_path)
+    df = read_dataset('all_patients', ['patient_key', 'sex'], '2021-02-01', '2021-02-01', str(tmp_path))
+    assert list(df.columns) == ['patient_key', 'sex', 'date']
+    assert df['sex'].astype(str).tolist() == ['F', 'M', 'F']
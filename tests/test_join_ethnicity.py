@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from patient_keys import append_keys
+
+script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analysis', 'join_ethnicity.py')
+
+
+def test_append_keys_keeps_existing_keys():
+    keys = append_keys(np.array([30, 10, 20]), [40, 10, 5, 40])
+    assert keys.tolist() == [30, 10, 20, 5, 40]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / 'output' / 'data'
+    data_dir.mkdir(parents=True)
+    (tmp_path / 'logs').mkdir()
+    pd.DataFrame({'patient_id': [1, 2, 3], 'eth': [1, 2, None], 'ethnicity': [1, 2, 0]}) \
+        .to_csv(data_dir / 'input_ethnicity.csv', index=False)
+    write_month(data_dir, '2021-01-01', [3, 1, 4])
+    return data_dir
+
+
+def write_month(data_dir, date, patient_ids):
+    pd.DataFrame({'patient_id': patient_ids, 'age': 50}) \
+        .to_csv(data_dir / f'input_all_patients_{date}.csv', index=False)
+
+
+def join(data_dir):
+    subprocess.run([sys.executable, script, 'input_all_patients'], cwd=data_dir.parent.parent, check=True)
+    with open(data_dir / 'join_ethnicity_input_all_patients_manifest.json') as f:
+        return json.load(f)
+
+
+def read_month(data_dir, date):
+    return pd.read_csv(data_dir / f'input_all_patients_{date}.csv')
+
+
+def test_join_keys_and_joins_every_row(data_dir):
+    join(data_dir)
+    df = read_month(data_dir, '2021-01-01')
+    keys = np.load(data_dir / 'patient_keys_all_patients.npy')
+    assert keys.tolist() == [1, 2, 3, 4]
+    assert keys[df['patient_key']].tolist() == df['patient_id'].tolist()
+    # Patient 4 has no ethnicity row
+    assert df['ethnicity'].iloc[:2].tolist() == [0, 1]
+    assert df['ethnicity'].isna().tolist() == [False, False, True]
+
+
+def test_rerun_skips_joined_months_and_appends_new_patients(data_dir):
+    join(data_dir)
+    joined = os.stat(data_dir / 'input_all_patients_2021-01-01.csv').st_mtime_ns
+    write_month(data_dir, '2021-02-01', [5, 2])
+    manifest = join(data_dir)
+
+    # The joined month is not rewritten, and its patients keep their keys
+    assert os.stat(data_dir / 'input_all_patients_2021-01-01.csv').st_mtime_ns == joined
+    keys = np.load(data_dir / 'patient_keys_all_patients.npy')
+    assert keys.tolist() == [1, 2, 3, 4, 5]
+    for date in ['2021-01-01', '2021-02-01']:
+        df = read_month(data_dir, date)
+        assert keys[df['patient_key']].tolist() == df['patient_id'].tolist()
+    assert sorted(manifest['files']) == ['input_all_patients_2021-01-01.csv', 'input_all_patients_2021-02-01.csv']
+
+
+def test_changed_key_map_rejoins_every_month(data_dir):
+    join(data_dir)
+    joined = os.stat(data_dir / 'input_all_patients_2021-01-01.csv').st_mtime_ns
+    # A key map the manifest did not record is not trusted
+    np.save(data_dir / 'patient_keys_all_patients.npy', np.array([4, 3, 2, 1]))
+    join(data_dir)
+    assert os.stat(data_dir / 'input_all_patients_2021-01-01.csv').st_mtime_ns != joined
+    df = read_month(data_dir, '2021-01-01')
+    keys = np.load(data_dir / 'patient_keys_all_patients.npy')
+    assert keys[df['patient_key']].tolist() == df['patient_id'].tolist()
@@ -0,0 +1,66 @@
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from expressions import variable_window
+from local_extract import Events, LocalColumns
+
+index_date = '2021-03-01'
+
+windows = {
+    'last_year': {'between': ['index_date - 12 months', 'index_date']},
+    'this_month': {'between': ['first_day_of_month(index_date)', 'last_day_of_month(index_date)']},
+    'before_2020': {'on_or_before': '2019-12-31'},
+    'since_2021': {'on_or_after': '2021-01-01'},
+}
+
+
+@pytest.fixture
+def columns():
+    rng = np.random.default_rng(2)
+    patient_ids = np.sort(rng.choice(10000, 200, replace=False)).astype(np.int64)
+    n = 5000
+    events = pd.DataFrame({
+        # Some events belong to patients outside the cohort
+        'patient_id': rng.choice(np.concatenate([patient_ids, [10001, 10002]]), n),
+        'date': (pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 1500, n), unit='D')).strftime('%Y-%m-%d'),
+        'code': rng.choice(['A', 'B', 'C'], n),
+        'numeric_value': rng.normal(45, 10, n).round(1),
+    })
+    codelists = {'wanted': {'codes': ['A', 'B'], 'categories': None}}
+    tables = types.SimpleNamespace(patient_ids=patient_ids,
+                                   events={'clinical_events': Events(events, patient_ids, codelists)})
+    specs = {name: {'function': 'with_these_clinical_events', 'args': [{'codelist': 'wanted'}],
+                    'kwargs': {**kwargs, 'returning': 'number_of_matches_in_period'}}
+             for name, kwargs in windows.items()}
+    specs['last_value'] = {'function': 'with_these_clinical_events', 'args': [{'codelist': 'wanted'}],
+                           'kwargs': {**windows['last_year'], 'returning': 'numeric_value',
+                                      'find_last_match_in_period': True}}
+    return LocalColumns(specs, tables, index_date), events
+
+
+def brute_force(events, patient_ids, kwargs):
+    start, end = variable_window(kwargs, index_date)
+    dates = pd.to_datetime(events['date'])
+    rows = events[events['code'].isin(['A', 'B']) & events['patient_id'].isin(patient_ids)
+                  & (dates >= (start or pd.Timestamp.min)) & (dates <= (end or pd.Timestamp.max))]
+    return rows
+
+
+@pytest.mark.parametrize('name', windows)
+def test_window_counts_match_filter(columns, name):
+    columns, events = columns
+    rows = brute_force(events, columns.tables.patient_ids, windows[name])
+    want = rows.groupby('patient_id').size().reindex(columns.tables.patient_ids, fill_value=0)
+    assert np.array_equal(columns[name], want.to_numpy())
+
+
+def test_last_value_matches_filter(columns):
+    columns, events = columns
+    rows = brute_force(events, columns.tables.patient_ids, windows['last_year'])
+    # Events on the same day keep their order in the table
+    last = rows.sort_values('date', kind='stable').groupby('patient_id')['numeric_value'].last()
+    want = last.reindex(columns.tables.patient_ids, fill_value=0.0)
+    assert np.array_equal(columns['last_value'], want.to_numpy())
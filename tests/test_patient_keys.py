@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from patient_keys import build_keys, find_keys, key_frame, key_index, lookup_keys
+
+
+def test_build_keys_puts_master_ids_first():
+    keys = build_keys([30, 10, 20, 10], [25, 10, 5])
+    assert keys.tolist() == [10, 20, 30, 5, 25]
+
+
+def test_lookup_keys_inverts_the_map():
+    keys = build_keys([30, 10, 20], [25])
+    index = key_index(keys)
+    assert lookup_keys(index, [25, 10, 30]).tolist() == [3, 0, 2]
+    assert find_keys(index, [20, 99]).tolist() == [1, -1]
+    with pytest.raises(ValueError):
+        lookup_keys(index, [99])
+
+
+def test_key_frame_scatters_rows_to_key_order():
+    keys = build_keys([10, 20, 30], [])
+    df = pd.DataFrame({'patient_id': [30, 10, 99], 'eth': ['3', '1', '9'], 'imd': [300, 100, 900]})
+    by_key = key_frame(df, keys, ['eth', 'imd'])
+    assert by_key['patient_key'].tolist() == [0, 1, 2]
+    assert by_key['eth'].tolist() == ['1', '', '3']
+    assert by_key['imd'].tolist() == [100, 0, 300]
+    assert by_key['imd'].dtype == np.int64
@@ -0,0 +1,25 @@
+import numpy as np
+
+from patient_sets import count, difference, intersection, patient_keys, patient_set, union
+
+
+def test_set_algebra_matches_python_sets():
+    rng = np.random.default_rng(5)
+    a_keys = rng.choice(1000, 300)
+    b_keys = rng.choice(700, 200)
+    c_keys = rng.choice(1000, 500)
+    a, b, c = (set(keys.tolist()) for keys in (a_keys, b_keys, c_keys))
+    sa, sb, sc = patient_set(a_keys), patient_set(b_keys), patient_set(c_keys)
+    assert count(sa) == len(a)
+    assert patient_keys(union(sa, sb, sc)).tolist() == sorted(a | b | c)
+    assert patient_keys(intersection(sa, sb, sc)).tolist() == sorted(a & b & c)
+    # Bitmaps of different lengths are aligned before combining
+    assert patient_keys(difference(sa, sb)).tolist() == sorted(a - b)
+    assert patient_keys(difference(sb, sa)).tolist() == sorted(b - a)
+
+
+def test_empty_sets():
+    empty = patient_set([])
+    assert count(empty) == 0
+    assert count(union(empty, patient_set([3]))) == 1
+    assert count(intersection(empty, patient_set([3]))) == 0
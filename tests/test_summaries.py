@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from schema import apply_schema
+from config import suppression
+from summaries import description_histograms, sketch_month, table_demographics, table_summaries
+from thresholds import hba1c_band
+
+
+def month(date, n, rng):
+    hba1c = np.where(rng.random(n) < 0.5, np.nan, rng.normal(50, 10, n))
+    df = pd.DataFrame({
+        'patient_key': np.arange(n),
+        'took_hba1c': (~np.isnan(hba1c)).astype(int),
+        'diabetes_type': rng.choice(['NO_DM', 'T1DM', 'T2DM'], n, p=[0.5, 0.1, 0.4]),
+        'hba1c_mmol_per_mol': hba1c,
+        'hba1c_band': hba1c_band(hba1c),
+        'age_group': rng.choice(['16-24', '25-34', '75+'], n),
+        'sex': rng.choice(['F', 'M'], n),
+        # Patients without an ethnicity row and with the DEFAULT mental
+        # illness category both read as missing
+        'ethnicity': rng.choice([1, 2, 5, np.nan], n),
+        'region': rng.choice(['London', 'North East'], n),
+        'imd': rng.choice([0, 1, 5], n),
+        'learning_disability': rng.integers(0, 2, n),
+        'mental_illness': rng.choice(['None', 'Depression', 'Severe Mental Illness'], n, p=[0.8, 0.1, 0.1]),
+        'date': pd.Timestamp(date),
+    })
+    return apply_schema(df)
+
+
+def test_every_characteristic_counts_every_t2dm_patient():
+    rng = np.random.default_rng(3)
+    frames = [month('2021-01-01', 400, rng), month('2021-02-01', 500, rng)]
+    by_dm, by_demo = table_summaries(frames, 500)
+    totals = by_demo.groupby('characteristic')[['population', 'took_hba1c']].sum()
+    t2dm = by_dm.loc[by_dm.category == 'Type 2 Diabetes', ['population', 'took_hba1c']].iloc[0]
+    assert sorted(totals.index) == sorted(table_demographics.values())
+    assert (totals['population'] == t2dm['population']).all()
+    assert (totals['took_hba1c'] == t2dm['took_hba1c']).all()
+    assert 'Unknown' in by_demo.loc[by_demo.characteristic == 'Ethnicity', 'category'].tolist()
+    assert 'None' in by_demo.loc[by_demo.characteristic == 'Mental Illness', 'category'].tolist()
+
+
+def test_released_histograms_and_quantiles_are_suppressed():
+    rng = np.random.default_rng(6)
+    sketch = pd.concat([sketch_month(month(date, 300, rng)) for date in ['2021-01-01', '2021-02-01']])
+    hists, stats = description_histograms(sketch)
+    assert (hists['count'].dropna() > suppression['threshold']).all()
+    assert hists['count'].isna().any()
+    # Series with too few tests have no quantiles
+    small = stats['count'].isna()
+    assert stats.loc[small, ['q1', 'median', 'q3']].isna().all().all()
+    assert stats.loc[~small, 'median'].notna().all()
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from suppression import suppress
+
+
+def table():
+    return pd.DataFrame({
+        'date': ['2021-01-01'] * 3 + ['2021-02-01'] * 3,
+        'group': list('abc') * 2,
+        'numerator': [3, 12, 40, 9, 14, 6],
+        'population': [50, 60, 70, 80, 90, 100],
+    })
+
+
+def test_primary_suppression_drops_small_counts():
+    df = suppress(table(), ['numerator', 'population'], threshold=5, secondary=False, rounding=None)
+    assert df['numerator'].tolist() == [12, 40, 9, 14, 6]
+
+
+def test_primary_suppression_masks_small_counts():
+    df = suppress(table(), ['numerator'], action='mask', threshold=5, secondary=False, rounding=None)
+    assert df['numerator'].isna().tolist() == [True, False, False, False, False, False]
+    assert df['population'].tolist() == table()['population'].tolist()
+
+
+def test_secondary_suppression_hides_next_smallest_cell():
+    df = suppress(table(), ['numerator'], by='date', action='mask', threshold=5, secondary=True, rounding=None)
+    # 3 is suppressed, so 12, the next smallest of 2021-01-01, is too; no
+    # cell of 2021-02-01 is at or below the threshold
+    assert df['numerator'].isna().tolist() == [True, True, False, False, False, False]
+
+
+def test_secondary_suppression_leaves_groups_with_several_suppressed_cells():
+    df = table()
+    df['numerator'] = [3, 4, 40, 9, 14, 6]
+    df = suppress(df, ['numerator'], by='date', action='mask', threshold=5, secondary=True, rounding=None)
+    assert df['numerator'].isna().tolist() == [True, True, False, False, False, False]
+
+
+def test_rounding_to_nearest_multiple():
+    df = suppress(table(), ['numerator', 'population'], threshold=5, secondary=False, rounding=5)
+    assert df['numerator'].tolist() == [10, 40, 10, 15, 5]
+    assert df['numerator'].dtype == np.int64
+
+
+def test_rounding_keeps_missing_counts_missing():
+    df = table().astype({'numerator': float})
+    df.loc[1, 'numerator'] = np.nan
+    df = suppress(df, ['numerator'], action='mask', threshold=5, secondary=False, rounding=5)
+    assert df['numerator'].isna().tolist() == [True, True, False, False, False, False]
+    assert df['numerator'].iloc[2:].tolist() == [40, 10, 15, 5]
@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+from thresholds import band_sums, hba1c_band, threshold_column
+
+
+def test_hba1c_band_cut_points():
+    values = [np.nan, 0, 47.9, 48, 48.1, 58, 58.5, 64, 64.1, 75, 75.1, 200]
+    assert hba1c_band(values, [48, 58, 64, 75]).tolist() == [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+
+
+def test_band_counts_match_threshold_flags():
+    rng = np.random.default_rng(1)
+    values = np.where(rng.random(1000) < 0.1, np.nan, rng.integers(30, 100, 1000).astype(float))
+    df = pd.DataFrame({'date': '2021-01-01', 'hba1c_band': hba1c_band(values), 'population': 1})
+    counts = band_sums(df.groupby(['date', 'hba1c_band'], as_index=False)['population'].sum(),
+                       ['date'], 'population')
+    for limit in [48, 58, 64, 75]:
+        assert counts[threshold_column(limit)].iloc[0] == (values > limit).sum()
+    assert counts['population'].iloc[0] == len(values)